@@ -0,0 +1,9 @@
+# the library API is imported on first use, the command line doesn't need it
+_API = ("build", "BuildSpec", "BuildResult")
+
+
+def __getattr__(name):
+    if name in _API:
+        from anaconda_updates import api
+        return getattr(api, name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -0,0 +1,423 @@
+import os
+import time
+import shutil
+import tempfile
+import subprocess
+
+from contextlib import contextmanager
+
+from anaconda_updates.cache import FileCache, DEFAULT_MAX_SIZE, source_tree_id, directory_hash, build_key
+from anaconda_updates.compress import CODECS, DEFAULT_CODEC, parse_codec
+from anaconda_updates.image import ImageBuilder, ImageBuildError, STAGED_PATHS, clean_updates_dir
+from anaconda_updates.lock import FileLock, checkout_lock_path
+from anaconda_updates.staging import Stager, STAGE_MODE_COPY, file_hash
+from anaconda_updates.upload import PushRecord, FanOutUpload, UploadError, upload_file, mark_uploaded
+
+# projects which can be added to the image and where they are installed
+PROJECTS = ("blivet", "pykickstart", "simpleline")
+
+
+class BuildSpec(object):
+    """Everything needed to build (and upload) one updates image.
+
+    Nothing is taken from GlobalSettings and all paths must be absolute, so
+    any number of builds can run at the same time in one process.
+
+    anaconda_dir    - anaconda checkout
+    tag             - files changed since this git tag or commit are added
+    output_path     - where the image is created
+    img_name        - name of the image on the upload targets
+    projects        - mapping of the project name (blivet, pykickstart,
+                      simpleline) to its checkout
+    addons          - addon directories
+    rpms            - RPM packages added to the image
+    native          - use the native builder, otherwise the makeupdates script
+    compile         - compile anaconda (makeupdates only)
+    extra_args      - additional makeupdates arguments (branch specific)
+    codec, level    - compression of the native image
+    jobs            - number of compression threads
+    stage_mode      - copy or link, see Stager
+    work_dir        - directory of the state kept between builds (staging
+                      manifests, delta chain); a temporary directory is
+                      used when not set
+    updates_dir     - updates folder the projects and addons are staged in
+                      and the image is created from; the folder of the
+                      checkout for the makeupdates script, work_dir/updates
+                      otherwise
+    keep            - keep the files other than the staged projects and
+                      addons in the updates folder after the build
+    delta           - append files changed since the last build to the
+                      image kept in work_dir (native only)
+    pipeline        - upload the image while it is created (native only)
+    cache_dir       - directory of the image and segment caches, nothing is
+                      cached when not set
+    cache_size      - size limit of every cache in bytes
+    shared_cache    - the caches are shared with other users, see FileCache
+    build_cache     - reuse and store finished images, otherwise only the
+                      segments are cached
+    targets         - UploadTarget list, the image is not uploaded when empty
+    push_record     - path of the local record of uploaded images
+    """
+
+    def __init__(self, anaconda_dir, tag, output_path, img_name="updates.img",
+                 projects=None, addons=(), rpms=(), native=True, compile=False,
+                 extra_args=(), codec=DEFAULT_CODEC, level=None, jobs=1,
+                 stage_mode=STAGE_MODE_COPY, work_dir=None, cache_dir=None,
+                 targets=(), push_record=None, delta_upload=False, force_upload=False,
+                 updates_dir=None, keep=False, delta=False, pipeline=False,
+                 cache_size=DEFAULT_MAX_SIZE, shared_cache=False, build_cache=True):
+        self.anaconda_dir = anaconda_dir
+        self.tag = tag
+        self.output_path = output_path
+        self.img_name = img_name
+        self.projects = dict(projects or {})
+        self.addons = list(addons)
+        self.rpms = list(rpms)
+        self.native = native
+        self.compile = compile
+        self.extra_args = list(extra_args)
+        self.codec = codec
+        self.level = level if level is not None else CODECS[codec].default_level
+        self.jobs = jobs
+        self.stage_mode = stage_mode
+        self.work_dir = work_dir
+        self.cache_dir = cache_dir
+        self.targets = list(targets)
+        self.push_record = push_record
+        self.delta_upload = delta_upload
+        self.force_upload = force_upload
+        if updates_dir is None:
+            if not native:
+                updates_dir = os.path.join(anaconda_dir, "updates")
+            elif work_dir:
+                updates_dir = os.path.join(work_dir, "updates")
+        self.updates_dir = updates_dir
+        self.keep = keep
+        self.delta = delta
+        self.pipeline = pipeline
+        self.cache_size = cache_size
+        self.shared_cache = shared_cache
+        self.build_cache = build_cache
+        self._key = None
+
+    @classmethod
+    def from_branch(cls, branch, anaconda_dir, output_path, projects_path=None, projects=(),
+                    version_script="", version_cache=None, tags=None, repo_base_url="", resolver=None,
+                    tag=None, img_name=None, **kwargs):
+        """Return spec of the image for the branch (a GeneralBranch instance).
+
+        The projects are taken from the projects path. Without the tag the
+        target version of the branch is used. It is looked up in the
+        repository under repo_base_url by the RepodataResolver when the branch
+        has one, otherwise the version script is called when the branch
+        doesn't know it; the result is kept in the optional VersionCache.
+        With the TagIndex the version is taken from the tags of the checkout.
+        The image name of the branch is used when img_name is not set.
+        """
+        if tag is None:
+            if tags is None and not branch._version and branch.repo_url(repo_base_url) and resolver is None:
+                raise ValueError("RepodataResolver is needed to find the version in {}".format(
+                    branch.repo_url(repo_base_url)))
+            tag = "anaconda-{}-1".format(branch.resolve_version(version_script, version_cache, tags,
+                                                                repo_base_url=repo_base_url,
+                                                                resolver=resolver))
+
+        projects = [project for project in projects if project not in branch.without_projects]
+        if projects and projects_path is None:
+            raise ValueError("Projects path is needed to add {}".format(", ".join(projects)))
+        extra_args = list(branch.input_args)
+        for project in projects:
+            extra_args.extend(getattr(branch, project + "_args"))
+
+        kwargs.setdefault("codec", parse_codec(branch.default_codec)[0])
+        if kwargs["codec"] not in branch.codecs:
+            raise ValueError("Installer of this branch can't load {} compressed images".format(
+                kwargs["codec"]))
+
+        return cls(anaconda_dir, tag, output_path, img_name=img_name or branch.img_name,
+                   projects={project: os.path.join(projects_path, project) for project in projects},
+                   extra_args=extra_args, **kwargs)
+
+    def check(self):
+        paths = [self.anaconda_dir, self.output_path, *self.projects.values(), *self.addons, *self.rpms]
+        paths.extend(path for path in (self.work_dir, self.updates_dir, self.cache_dir, self.push_record)
+                     if path)
+
+        for path in paths:
+            if not os.path.isabs(path):
+                raise ValueError("Path {} is not absolute".format(path))
+
+        for project in self.projects:
+            if project not in PROJECTS:
+                raise ValueError("Unknown project {}".format(project))
+
+        if not self.native:
+            if self.updates_dir != os.path.join(self.anaconda_dir, "updates"):
+                raise ValueError("The makeupdates script creates the image only from the updates folder "
+                                 "of the checkout")
+            if self.delta or self.pipeline:
+                raise ValueError("Delta and pipelined images need the native builder")
+        if self.delta and not self.work_dir:
+            raise ValueError("Delta image needs the work directory keeping the previous image")
+
+    def cache(self, name):
+        """Return the cache (builds or segments) in the cache directory."""
+        return FileCache(os.path.join(self.cache_dir, name), self.cache_size, shared=self.shared_cache)
+
+    def makeupdates_command(self):
+        cmd = [os.path.join(self.anaconda_dir, "scripts/makeupdates"), "-t", self.tag]
+        if self.compile:
+            cmd.append("-c")
+        for rpm in self.rpms:
+            cmd.extend(["-a", rpm])
+        return cmd + self.extra_args
+
+    def inputs(self):
+        """Return everything the image is created from."""
+        inputs = {
+            "tag": self.tag,
+            "native": self.native,
+            "compile": self.compile,
+            "extra_args": self.extra_args,
+            "anaconda": source_tree_id(self.anaconda_dir, exclude=("updates", "updates.img")),
+            "projects": {name: source_tree_id(path) for name, path in self.projects.items()},
+            "addons": {os.path.basename(addon): source_tree_id(addon) for addon in self.addons},
+            "rpms": {os.path.basename(rpm): file_hash(rpm) for rpm in self.rpms},
+        }
+
+        if self.native:
+            inputs["compression"] = [self.codec, self.level]
+
+        # files left in the updates folder are added to the image as well, with -p it is all of it
+        if self.updates_dir:
+            inputs["updates"] = directory_hash(self.updates_dir, exclude=STAGED_PATHS)
+
+        return inputs
+
+    def key(self, fresh=False):
+        """Return build cache key of the spec, computed only once unless fresh."""
+        if self._key is None or fresh:
+            self._key = build_key(self.inputs())
+        return self._key
+
+
+class BuildResult(object):
+    def __init__(self, image_path):
+        self.image_path = image_path
+        self.size = 0
+        self.seconds = 0.0
+        # image was taken from the build cache
+        self.cached = False
+        # staging statistics of every project and addon
+        self.staging = {}
+        # UploadResult of every target
+        self.uploads = []
+
+    @property
+    def ok(self):
+        return all(upload.ok for upload in self.uploads)
+
+
+def _stage(spec, updates_dir, manifest_dir, result):
+    stager = Stager(manifest_dir, spec.stage_mode)
+    addons_dir = os.path.join(updates_dir, "usr/share/anaconda/addons")
+    projects_dir = os.path.join(updates_dir, "run/install/updates")
+
+    # remove what previous builds staged and this one doesn't want
+    addon_names = [os.path.basename(addon) for addon in spec.addons]
+    if os.path.isdir(addons_dir):
+        for name in os.listdir(addons_dir):
+            if name not in addon_names:
+                shutil.rmtree(os.path.join(addons_dir, name))
+    for project in PROJECTS:
+        if project not in spec.projects:
+            shutil.rmtree(os.path.join(projects_dir, project), ignore_errors=True)
+
+    for addon in spec.addons:
+        name = os.path.basename(addon)
+        stats = stager.stage("addon-" + name, addon, os.path.join(addons_dir, name))
+        print("Addon {}: {}".format(name, stats))
+        result.staging["addon-" + name] = stats
+
+    for project, path in spec.projects.items():
+        stats = stager.stage(project, os.path.join(path, project), os.path.join(projects_dir, project))
+        print("{}: {}".format(project.capitalize(), stats))
+        result.staging[project] = stats
+
+
+def _staging_dirs(spec, work_dir):
+    """Return the updates folder of the build and the directory of its staging manifests."""
+    if spec.updates_dir is None or spec.updates_dir == os.path.join(work_dir, "updates"):
+        return os.path.join(work_dir, "updates"), os.path.join(work_dir, "manifests")
+    return spec.updates_dir, os.path.join(work_dir, "checkout-manifests")
+
+
+@contextmanager
+def _staging_lock(spec, work_dir):
+    """Hold the lock of the updates folder and the state in the work directory while the image is created.
+
+    The makeupdates script and the updates folder of the checkout need the
+    lock of the checkout, builds in a temporary directory don't need any.
+    """
+    if not spec.native or (spec.updates_dir or "").startswith(spec.anaconda_dir + os.sep):
+        lock = FileLock(checkout_lock_path(spec.anaconda_dir, work_dir), spec.anaconda_dir)
+    elif spec.work_dir:
+        lock = FileLock(os.path.join(work_dir, "build.lock"), work_dir)
+    else:
+        lock = None
+
+    if lock is None:
+        yield
+    else:
+        with lock:
+            yield
+
+
+def _mark_streamed(spec, image_path, uploads, record):
+    digest = file_hash(image_path)
+    targets = {target.name: target for target in spec.targets}
+
+    for upload in uploads:
+        if not upload.ok:
+            continue
+        try:
+            mark_uploaded(targets[upload.name], spec.img_name, digest, record)
+        except UploadError as e:
+            print("Can't store image checksum on {}: {}".format(upload.name, e))
+
+
+def _build_native(spec, updates_dir, work_dir, image_path, record):
+    """Create the image, return upload results when it was streamed to the targets."""
+    builder = ImageBuilder(spec.anaconda_dir, tag=spec.tag, rpms=spec.rpms, keep=spec.keep, jobs=spec.jobs,
+                           codec=spec.codec, level=spec.level, updates_dir=updates_dir,
+                           cache=spec.cache("segments") if spec.cache_dir else None)
+
+    upload = None
+    if spec.pipeline and spec.targets:
+        print("Uploading image to", ", ".join(target.name for target in spec.targets), "while it is created")
+        upload = FanOutUpload(spec.targets, spec.img_name)
+
+    try:
+        if spec.delta:
+            builder.build_delta(image_path, os.path.join(work_dir, "delta"), upload)
+        else:
+            builder.build(image_path, upload)
+    except BaseException:
+        # e.g. Ctrl-C, nothing may replace the image on the servers
+        if upload:
+            upload.abort()
+        raise
+
+    if upload is None:
+        return None
+
+    uploads = upload.close()
+    _mark_streamed(spec, image_path, uploads, record)
+    return uploads
+
+
+def _build_makeupdates(spec, updates_dir, image_path):
+    # -k keeps the staged projects for the next build, the rest is cleaned below
+    command = spec.makeupdates_command()
+    command = command[:1] + ["-k"] + command[1:]
+    print("Calling command:", command)
+
+    try:
+        out = subprocess.check_output(command, cwd=spec.anaconda_dir, stderr=subprocess.STDOUT)
+    except subprocess.CalledProcessError as e:
+        raise ImageBuildError("Error calling makeupdates script: {}".format(e.output.decode()))
+    finally:
+        if not spec.keep:
+            clean_updates_dir(updates_dir)
+
+    print(out.decode())
+    # the next build may start in the checkout while this image is uploaded
+    shutil.move(os.path.join(spec.anaconda_dir, "updates.img"), image_path)
+
+
+def _build_key(spec, fresh=False):
+    try:
+        return spec.key(fresh)
+    except (subprocess.CalledProcessError, OSError) as e:
+        print("Can't compute the build cache key:", e)
+        return None
+
+
+def build(spec):
+    """Build the image described by the BuildSpec, upload it and return BuildResult.
+
+    The image appears at the output path at once when it is complete.
+    Raises ImageBuildError (or ValueError for an invalid spec) when the
+    image can't be built; upload failures are only reported in the result,
+    except a pipelined upload failing on all targets (UploadError).
+    """
+    spec.check()
+    start = time.monotonic()
+    result = BuildResult(spec.output_path)
+
+    cache = key = None
+    if spec.cache_dir and spec.build_cache:
+        key = _build_key(spec)
+        if key is not None:
+            cache = spec.cache("builds")
+
+    record = None
+    if spec.targets:
+        record = PushRecord(spec.push_record)
+        record.load()
+
+    work_dir = spec.work_dir or tempfile.mkdtemp(prefix="anaconda-updates-build-")
+    os.makedirs(work_dir, exist_ok=True)
+    output_dir = os.path.dirname(spec.output_path)
+    os.makedirs(output_dir, exist_ok=True)
+    # the build and the upload use their own file, published only when complete
+    fd, tmp_path = tempfile.mkstemp(prefix=".updates-", suffix=".tmp", dir=output_dir)
+    os.close(fd)
+
+    try:
+        if cache is not None:
+            with cache.read(key) as f_in:
+                if f_in is not None:
+                    print("Reusing image from the build cache", cache.path(key))
+                    with open(tmp_path, "wb") as f_out:
+                        shutil.copyfileobj(f_in, f_out)
+                    result.cached = True
+
+        if not result.cached:
+            updates_dir, manifest_dir = _staging_dirs(spec, work_dir)
+            with _staging_lock(spec, work_dir):
+                if cache is not None:
+                    # the sources may have changed while waiting for the lock,
+                    # the image is stored under the key of what is built
+                    key = _build_key(spec, fresh=True)
+                    if key is None:
+                        cache = None
+                _stage(spec, updates_dir, manifest_dir, result)
+                if spec.native:
+                    result.uploads = _build_native(spec, updates_dir, work_dir, tmp_path, record) or []
+                else:
+                    _build_makeupdates(spec, updates_dir, tmp_path)
+
+            if cache is not None:
+                with open(tmp_path, "rb") as f_in, cache.store(key) as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+                cache.prune()
+
+        result.size = os.path.getsize(tmp_path)
+
+        if spec.targets and not result.uploads:
+            print("Uploading image to", ", ".join(target.name for target in spec.targets))
+            result.uploads = upload_file(tmp_path, spec.img_name, spec.targets, record,
+                                         spec.delta_upload, spec.force_upload)
+        elif record is not None:
+            record.save()
+
+        os.replace(tmp_path, spec.output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        if not spec.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    result.seconds = time.monotonic() - start
+    return result
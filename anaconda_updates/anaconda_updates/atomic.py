@@ -0,0 +1,53 @@
+import os
+import json
+import fcntl
+import socket
+import threading
+
+from contextlib import contextmanager
+
+
+def tmp_path(path):
+    """Return name of a temporary file next to the path.
+
+    The name is unique for every host, process and thread, so concurrent
+    writers (e.g. on NFS) never write the same temporary file.
+    """
+    return "{}.{}.{}.{}.tmp".format(path, socket.gethostname(), os.getpid(), threading.get_ident())
+
+
+@contextmanager
+def locked(path):
+    """Hold exclusive lock of the file (on path.lock) against other processes and threads."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".lock", "a") as f_lock:
+        fcntl.flock(f_lock, fcntl.LOCK_EX)
+        yield
+
+
+def load_json(path):
+    """Return content of the JSON file, empty dictionary when it is missing or damaged."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def store_json(path, data, mode=None, **kwargs):
+    """Write the data to the JSON file at once, readers see the old or the new content.
+
+    mode    - permissions of the file, the default of the process when None
+    kwargs  - arguments of json.dump
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = tmp_path(path)
+    try:
+        with open(tmp, "w") as f:
+            json.dump(data, f, **kwargs)
+        if mode is not None:
+            os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
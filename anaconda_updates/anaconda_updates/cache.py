@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import stat
+import fcntl
+import hashlib
+import subprocess
+
+from contextlib import contextmanager
+
+from anaconda_updates.atomic import tmp_path, load_json, store_json
+from anaconda_updates.staging import file_hash
+
+DEFAULT_MAX_SIZE = 2 * 1024 ** 3
+LOCK_FILE = ".lock"
+STATS_LOCK = ".stats.lock"
+STATS_FILE = "stats.json"
+SHARED_FILE_MODE = 0o664
+SHARED_DIR_MODE = 0o2775
+# temporary files older than this are left over by crashed writers
+STALE_TMP_AGE = 24 * 60 * 60
+
+
+class FileCache(object):
+    """Content addressed store of files.
+
+    Files are stored under their key (a hex digest of everything they were
+    created from). Files are written to a temporary file and renamed when
+    complete, so a half written file is never visible. When the cache grows
+    over max_size the least recently used files are removed.
+
+    The cache can be shared by several users and hosts (e.g. on NFS).
+    Readers hold a shared lock while reading a file and pruning holds an
+    exclusive one, so no file is removed while it is read. Concurrent
+    stores of the same key are harmless, the content is the same. A shared
+    cache creates its files group writable. Hits and misses of all users
+    are counted in stats.json.
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE, shared=False):
+        self.directory = directory
+        self.max_size = max_size
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _makedirs(self, path):
+        if os.path.isdir(path):
+            return
+
+        os.makedirs(path, exist_ok=True)
+        if self.shared:
+            try:
+                # setgid keeps the group of the cache for new files
+                os.chmod(path, SHARED_DIR_MODE)
+            except PermissionError:
+                pass
+
+    @contextmanager
+    def _lock(self, name, operation):
+        self._makedirs(self.directory)
+        fd = os.open(os.path.join(self.directory, name), os.O_RDWR | os.O_CREAT, SHARED_FILE_MODE)
+        try:
+            if self.shared:
+                try:
+                    os.fchmod(fd, SHARED_FILE_MODE)
+                except PermissionError:
+                    # created by another user
+                    pass
+            fcntl.flock(fd, operation)
+            yield
+        finally:
+            os.close(fd)
+
+    def _count(self, **counts):
+        """Add counts to the statistics of the cache."""
+        stats_path = os.path.join(self.directory, STATS_FILE)
+        with self._lock(STATS_LOCK, fcntl.LOCK_EX):
+            stats = self.stats()
+            for name, count in counts.items():
+                stats[name] = stats.get(name, 0) + count
+
+            store_json(stats_path, stats, mode=SHARED_FILE_MODE if self.shared else None)
+
+    def stats(self):
+        """Return statistics of the cache (hits, misses, stores and evictions)."""
+        return load_json(os.path.join(self.directory, STATS_FILE))
+
+    def size(self):
+        """Return tuple of the number of files and their total size."""
+        entries = self._entries()
+        return len(entries), sum(size for _, size, _ in entries)
+
+    @contextmanager
+    def read(self, key):
+        """Open the cached file for reading, None is returned when it isn't cached."""
+        path = self.path(key)
+
+        with self._lock(LOCK_FILE, fcntl.LOCK_SH):
+            try:
+                f = open(path, "rb")
+            except FileNotFoundError:
+                f = None
+
+            if f is None:
+                self.misses += 1
+                self._count(misses=1)
+                yield None
+                return
+
+            with f:
+                # mark as recently used
+                os.utime(path)
+                self.hits += 1
+                self._count(hits=1)
+                yield f
+
+    @contextmanager
+    def store(self, key):
+        path = self.path(key)
+        self._makedirs(os.path.dirname(path))
+        tmp = tmp_path(path)
+
+        try:
+            with open(tmp, "wb") as f:
+                yield f
+            if self.shared:
+                os.chmod(tmp, SHARED_FILE_MODE)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+        self._count(stores=1)
+
+    def _entries(self):
+        """Return list of (mtime, size, path) of the cached files and stale temporary files."""
+        entries = []
+        now = time.time()
+
+        for dir_path, _, file_names in os.walk(self.directory):
+            if dir_path == self.directory:
+                # lock and statistics files
+                continue
+
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+
+                # temporary files may be written right now by someone else
+                if file_name.endswith(".tmp") and now - st.st_mtime < STALE_TMP_AGE:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+
+        return entries
+
+    def prune(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_size:
+            return
+
+        evicted = 0
+        with self._lock(LOCK_FILE, fcntl.LOCK_EX):
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_size:
+                    break
+                try:
+                    os.unlink(path)
+                    evicted += 1
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+        self._count(evictions=evicted)
+
+
+def _git(path, *args, input=None):
+    return subprocess.check_output(["git", "-C", path, *args], input=input,
+                                   stderr=subprocess.DEVNULL).decode()
+
+
+def directory_hash(path, exclude=()):
+    """Return hash of all file names and contents in the directory.
+
+    The excluded subdirectories (relative to the directory) are skipped.
+    """
+    digest = hashlib.sha256()
+
+    for dir_path, dir_names, file_names in os.walk(path, followlinks=True):
+        dir_names[:] = sorted(name for name in dir_names
+                              if os.path.relpath(os.path.join(dir_path, name), path) not in exclude)
+        for file_name in sorted(file_names):
+            file_path = os.path.join(dir_path, file_name)
+            digest.update(os.path.relpath(file_path, path).encode() + b"\0")
+            digest.update(file_hash(file_path).encode())
+
+    return digest.hexdigest()
+
+
+def _git_changes(path, top_dir, exclude):
+    """Return sorted list of (path, mode, content id) of the changed files in the git checkout.
+
+    The paths are relative to the top directory of the checkout, deleted
+    files have no mode and no content id.
+    """
+    # --no-optional-locks: git status doesn't refresh the index either
+    status = _git(path, "--no-optional-locks", "status", "--porcelain", "-z", "--no-renames",
+                  "--untracked-files=all", "--", ".", *[":(exclude){}".format(p) for p in exclude])
+
+    changes = []
+    blobs = []
+    for entry in status.split("\0"):
+        if not entry:
+            continue
+        # "XY path", the paths are relative to the top directory
+        name = entry[3:]
+        file_path = os.path.join(top_dir, name)
+        try:
+            st = os.lstat(file_path)
+        except FileNotFoundError:
+            changes.append((name, None, None))
+            continue
+
+        if stat.S_ISLNK(st.st_mode):
+            changes.append((name, "120000", hashlib.sha256(os.fsencode(os.readlink(file_path))).hexdigest()))
+        elif stat.S_ISDIR(st.st_mode):
+            # submodule or nested repository
+            changes.append((name, "160000", source_tree_id(file_path)))
+        else:
+            blobs.append((name, "100755" if st.st_mode & 0o111 else "100644"))
+
+    if blobs:
+        # without -w the objects are not written to the repository
+        ids = _git(top_dir, "hash-object", "--stdin-paths",
+                   input="".join(name + "\n" for name, _ in blobs).encode()).split()
+        changes.extend((name, mode, blob_id) for (name, mode), blob_id in zip(blobs, ids))
+
+    return sorted(changes)
+
+
+def source_tree_id(path, exclude=()):
+    """Return id of the source tree in the directory including uncommitted changes.
+
+    For git repositories this is the id of the committed tree combined with
+    the content of the changed and untracked files (except the excluded
+    paths). Nothing is written to the repository, the files are hashed by
+    git hash-object without -w and git's stat cache keeps finding them
+    fast. Directories which aren't git repositories are hashed file by
+    file.
+    """
+    try:
+        top_dir = _git(path, "rev-parse", "--show-toplevel").strip()
+    except subprocess.CalledProcessError:
+        return directory_hash(path)
+
+    try:
+        tree = _git(path, "rev-parse", "--verify", "HEAD^{tree}").strip()
+    except subprocess.CalledProcessError:
+        # nothing committed yet
+        tree = ""
+
+    changes = _git_changes(path, top_dir, exclude)
+    if not changes:
+        return "git:" + tree
+
+    return "git:{}+{}".format(tree, hashlib.sha256(json.dumps(changes).encode()).hexdigest())
+
+
+def build_key(inputs):
+    """Return key of the build cache for the dictionary of build inputs."""
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
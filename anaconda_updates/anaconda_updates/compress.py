@@ -0,0 +1,300 @@
+import io
+import os
+import sys
+import gzip
+import lzma
+import time
+import zlib
+import struct
+import shutil
+
+from collections import deque
+
+BLOCK_SIZE = 1024 * 1024
+XZ_BLOCK_SIZE = 8 * 1024 * 1024
+DICT_SIZE = 32 * 1024
+GZIP_HEADER = b"\x1f\x8b\x08\x00" + b"\0\0\0\0" + b"\x00\x03"
+
+
+class CompressionError(Exception):
+    pass
+
+
+def _deflate_block(block, level, dictionary):
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                      zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY, dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    # full flush leaves the stream byte aligned so the blocks can be simply joined
+    return compressor.compress(block) + compressor.flush(zlib.Z_FULL_FLUSH)
+
+
+def _xz_block(block, level):
+    # CRC32 check is what the kernel xz decoder understands
+    return lzma.compress(block, format=lzma.FORMAT_XZ, check=lzma.CHECK_CRC32, preset=level)
+
+
+class _ParallelWriter(object):
+    """Base of the file objects compressing blocks of the input in a thread pool.
+
+    Only a limited number of blocks is in flight, so the memory use is bounded.
+    """
+
+    def __init__(self, fileobj, jobs, level, block_size):
+        self._fileobj = fileobj
+        self._level = level
+        self._block_size = block_size
+        # imported here, it is slow to import and only the parallel compression needs it
+        from concurrent.futures import ThreadPoolExecutor
+        self._pool = ThreadPoolExecutor(jobs)
+        self._max_pending = jobs * 2
+        self._pending = deque()
+        self._buffer = bytearray()
+        self._closed = False
+
+    def write(self, data):
+        self._buffer += data
+
+        while len(self._buffer) >= self._block_size:
+            block = bytes(self._buffer[:self._block_size])
+            del self._buffer[:self._block_size]
+            self._submit(block)
+
+        return len(data)
+
+    def _compress_job(self, block):
+        raise NotImplementedError()
+
+    def _submit(self, block):
+        if len(self._pending) >= self._max_pending:
+            self._fileobj.write(self._pending.popleft().result())
+
+        self._pending.append(self._pool.submit(*self._compress_job(block)))
+
+    def _finish(self):
+        pass
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+
+        while self._pending:
+            self._fileobj.write(self._pending.popleft().result())
+
+        self._pool.shutdown()
+        self._finish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ParallelGzipWriter(_ParallelWriter):
+    """Gzip compressing file object using several threads.
+
+    Blocks are deflated independently (primed by the last 32 KiB of the
+    preceding block like pigz does) and joined to a single standard gzip
+    member.
+    """
+
+    def __init__(self, fileobj, jobs, level=9, block_size=BLOCK_SIZE):
+        super().__init__(fileobj, jobs, level, block_size)
+        self._dictionary = b""
+        self._crc = 0
+        self._size = 0
+
+        self._fileobj.write(GZIP_HEADER)
+
+    def write(self, data):
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+        return super().write(data)
+
+    def _compress_job(self, block):
+        job = (_deflate_block, block, self._level, self._dictionary)
+        self._dictionary = block[-DICT_SIZE:]
+        return job
+
+    def _finish(self):
+        # empty final block
+        self._fileobj.write(zlib.compressobj(self._level, zlib.DEFLATED, -zlib.MAX_WBITS).flush())
+        self._fileobj.write(struct.pack("<II", self._crc & 0xffffffff, self._size & 0xffffffff))
+
+
+class ParallelXzWriter(_ParallelWriter):
+    """Xz compressing file object using several threads.
+
+    Every block is compressed to its own xz stream, xz decompresses
+    concatenated streams as one file.
+    """
+
+    def __init__(self, fileobj, jobs, level=6, block_size=XZ_BLOCK_SIZE):
+        super().__init__(fileobj, jobs, level, block_size)
+        self._empty = True
+
+    def _compress_job(self, block):
+        self._empty = False
+        return _xz_block, block, self._level
+
+    def _finish(self):
+        # an empty file is not valid xz, write an empty stream instead
+        if self._empty:
+            self._fileobj.write(_xz_block(b"", self._level))
+
+
+class _PlainWriter(object):
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+
+    def write(self, data):
+        return self._fileobj.write(data)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _open_gzip(fileobj, level, jobs):
+    if jobs > 1:
+        return ParallelGzipWriter(fileobj, jobs, level)
+    return gzip.GzipFile(filename="", fileobj=fileobj, mode="wb", compresslevel=level, mtime=0)
+
+
+def _open_xz(fileobj, level, jobs):
+    if jobs > 1:
+        return ParallelXzWriter(fileobj, jobs, level)
+    return lzma.LZMAFile(fileobj, "wb", format=lzma.FORMAT_XZ, check=lzma.CHECK_CRC32, preset=level)
+
+
+def _open_none(fileobj, level, jobs):
+    return _PlainWriter(fileobj)
+
+
+class Codec(object):
+    def __init__(self, name, levels, default_level, opener, reader):
+        self.name = name
+        self.levels = levels
+        self.default_level = default_level
+        self.open = opener
+        self.reader = reader
+
+
+CODECS = {
+    "gzip": Codec("gzip", range(1, 10), 9, _open_gzip, lambda f: gzip.GzipFile(fileobj=f, mode="rb")),
+    "xz": Codec("xz", range(0, 10), 6, _open_xz, lambda f: lzma.LZMAFile(f, "rb")),
+    "none": Codec("none", (None,), None, _open_none, lambda f: f),
+}
+
+DEFAULT_CODEC = "gzip"
+
+
+def parse_codec(spec):
+    """Parse CODEC[:LEVEL] string and return tuple (codec name, level)."""
+    name, _, level = spec.partition(":")
+
+    if name not in CODECS:
+        raise CompressionError("Unknown compression codec '{}', use one of: {}".format(
+            name, ", ".join(CODECS)))
+
+    codec = CODECS[name]
+    if not level:
+        return name, codec.default_level
+
+    try:
+        level = int(level)
+    except ValueError:
+        level = None
+
+    if level not in codec.levels:
+        raise CompressionError("Invalid compression level in '{}'".format(spec))
+
+    return name, level
+
+
+def codec_spec(name, level):
+    return name if level is None else "{}:{}".format(name, level)
+
+
+def open_compressor(fileobj, jobs=1, codec=DEFAULT_CODEC, level=None):
+    codec = CODECS[codec]
+    if level is None:
+        level = codec.default_level
+    return codec.open(fileobj, level, jobs)
+
+
+def benchmark(data, jobs_list):
+    """Compress data serially and in parallel, print time and size of the results."""
+    for jobs in jobs_list:
+        out = io.BytesIO()
+        start = time.monotonic()
+        with open_compressor(out, jobs) as compressor:
+            for offset in range(0, len(data), BLOCK_SIZE):
+                compressor.write(data[offset:offset + BLOCK_SIZE])
+        seconds = time.monotonic() - start
+
+        if gzip.decompress(out.getvalue()) != data:
+            raise RuntimeError("Decompressed data differ for {} jobs".format(jobs))
+
+        print("jobs {:3}: {:8.3f}s {:12} bytes {:8.1f} MB/s".format(
+            jobs, seconds, len(out.getvalue()), len(data) / seconds / 1e6))
+
+
+def benchmark_codecs(archive_path, specs, jobs=1, link_mbit=100):
+    """Compress the archive with every codec spec and return the results.
+
+    Every result is a tuple (spec, size, compress seconds, decompress seconds,
+    estimated transfer seconds) and the results are sorted by the sum of times.
+    """
+    results = []
+
+    for spec in specs:
+        name, level = parse_codec(spec)
+        out_path = archive_path + ".bench"
+
+        try:
+            start = time.monotonic()
+            with open(archive_path, "rb") as f_in, open(out_path, "wb") as f_out:
+                with open_compressor(f_out, jobs, name, level) as compressor:
+                    shutil.copyfileobj(f_in, compressor, BLOCK_SIZE)
+            compress_time = time.monotonic() - start
+
+            start = time.monotonic()
+            with open(out_path, "rb") as f_in:
+                reader = CODECS[name].reader(f_in)
+                while reader.read(BLOCK_SIZE):
+                    pass
+            decompress_time = time.monotonic() - start
+
+            size = os.path.getsize(out_path)
+        finally:
+            if os.path.exists(out_path):
+                os.unlink(out_path)
+
+        transfer_time = size * 8 / (link_mbit * 1e6)
+        results.append((codec_spec(name, level), size, compress_time, decompress_time, transfer_time))
+
+    results.sort(key=lambda r: r[2] + r[3] + r[4])
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: {} <file> [jobs...]".format(sys.argv[0]), file=sys.stderr)
+        sys.exit(1)
+
+    with open(sys.argv[1], "rb") as f:
+        benchmark(f.read(), [int(j) for j in sys.argv[2:]] or [1, os.cpu_count()])
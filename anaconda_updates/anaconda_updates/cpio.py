@@ -0,0 +1,157 @@
+import os
+import stat
+
+# "new" portable format (newc), this is what cpio -c and the kernel use
+NEWC_MAGIC = b"070701"
+HEADER_SIZE = 110
+TRAILER_NAME = "TRAILER!!!"
+CHUNK_SIZE = 1024 * 1024
+
+_FIELDS = ("ino", "mode", "uid", "gid", "nlink", "mtime", "filesize",
+           "devmajor", "devminor", "rdevmajor", "rdevminor", "namesize", "check")
+
+
+class CpioError(Exception):
+    pass
+
+
+def _padding(size):
+    return (4 - size % 4) % 4
+
+
+class CpioEntry(object):
+    def __init__(self, name, mode, filesize=0, mtime=0, ino=0, nlink=1,
+                 uid=0, gid=0, devmajor=0, devminor=0, rdevmajor=0, rdevminor=0):
+        self.name = name
+        self.mode = mode
+        self.filesize = filesize
+        self.mtime = mtime
+        self.ino = ino
+        self.nlink = nlink
+        self.uid = uid
+        self.gid = gid
+        self.devmajor = devmajor
+        self.devminor = devminor
+        self.rdevmajor = rdevmajor
+        self.rdevminor = rdevminor
+
+    @property
+    def is_trailer(self):
+        return self.name == TRAILER_NAME
+
+    def header(self):
+        name = self.name.encode() + b"\0"
+        values = dict(self.__dict__, namesize=len(name), check=0)
+        fields = b"".join(b"%08X" % values[field] for field in _FIELDS)
+        return NEWC_MAGIC + fields + name + b"\0" * _padding(HEADER_SIZE + len(name))
+
+
+class CpioWriter(object):
+    """Stream newc cpio entries to a file object.
+
+    Nothing is buffered except a single chunk of the file being archived, so
+    memory consumption doesn't depend on the size of the archive.
+    """
+
+    def __init__(self, fileobj, first_ino=1):
+        self._fileobj = fileobj
+        self._next_ino = first_ino
+        self.size = 0
+
+    def _write(self, data):
+        self._fileobj.write(data)
+        self.size += len(data)
+
+    def _new_ino(self):
+        ino = self._next_ino
+        self._next_ino += 1
+        return ino
+
+    def add_entry(self, entry, chunks=()):
+        if not entry.ino:
+            entry.ino = self._new_ino()
+
+        self._write(entry.header())
+
+        written = 0
+        for chunk in chunks:
+            self._write(chunk)
+            written += len(chunk)
+
+        if written != entry.filesize:
+            raise CpioError("Size of {} changed while archiving".format(entry.name))
+
+        self._write(b"\0" * _padding(written))
+
+    def add_directory(self, name, mode=0o755, mtime=0):
+        self.add_entry(CpioEntry(name, stat.S_IFDIR | mode, mtime=mtime, nlink=2))
+
+    def add_data(self, name, data, mode=0o644, mtime=0):
+        self.add_entry(CpioEntry(name, stat.S_IFREG | mode, filesize=len(data), mtime=mtime),
+                       [data])
+
+    def add_file(self, name, path):
+        st = os.stat(path)
+
+        if stat.S_ISDIR(st.st_mode):
+            self.add_directory(name, stat.S_IMODE(st.st_mode), int(st.st_mtime))
+            return
+
+        entry = CpioEntry(name, st.st_mode, filesize=st.st_size, mtime=int(st.st_mtime))
+        with open(path, "rb") as f:
+            self.add_entry(entry, iter(lambda: f.read(CHUNK_SIZE), b""))
+
+    def write_trailer(self):
+        self.add_entry(CpioEntry(TRAILER_NAME, 0, ino=0xffffffff, nlink=1))
+
+
+class CpioReader(object):
+    """Read newc cpio entries from a stream.
+
+    Iterating yields pairs of an entry and an iterator over its data, which
+    must be consumed (or skipped) before the next entry is read.
+    """
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+
+    def _read_exact(self, size):
+        data = self._fileobj.read(size)
+        while len(data) < size:
+            chunk = self._fileobj.read(size - len(data))
+            if not chunk:
+                raise CpioError("Unexpected end of cpio archive")
+            data += chunk
+        return data
+
+    def _data(self, size, state):
+        remaining = size
+        while remaining:
+            chunk = self._read_exact(min(remaining, CHUNK_SIZE))
+            remaining -= len(chunk)
+            yield chunk
+        state["consumed"] = True
+
+    def __iter__(self):
+        while True:
+            header = self._read_exact(HEADER_SIZE)
+            if header[:6] != NEWC_MAGIC:
+                raise CpioError("Unsupported cpio header {!r}".format(header[:6]))
+
+            values = {field: int(header[6 + i * 8:14 + i * 8], 16) for i, field in enumerate(_FIELDS)}
+            name = self._read_exact(values["namesize"])[:-1].decode()
+            self._read_exact(_padding(HEADER_SIZE + values["namesize"]))
+
+            del values["namesize"], values["check"]
+            entry = CpioEntry(name, **values)
+            if entry.is_trailer:
+                return
+
+            state = {"consumed": entry.filesize == 0}
+            data = self._data(entry.filesize, state)
+            yield entry, data
+
+            if not state["consumed"]:
+                for _ in data:
+                    pass
+            self._read_exact(_padding(entry.filesize))
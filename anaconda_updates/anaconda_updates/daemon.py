@@ -0,0 +1,296 @@
+import os
+import sys
+import json
+import socket
+import subprocess
+import threading
+import traceback
+import socketserver
+
+from anaconda_updates.api import build, BuildSpec, PROJECTS
+from anaconda_updates.compress import parse_codec, CompressionError
+from anaconda_updates.image import ImageBuildError
+from anaconda_updates.releases.repodata import RepodataError
+from anaconda_updates.releases.tags import TagIndexError
+from anaconda_updates.upload import PushRecord, UploadError, upload_file
+
+
+class DaemonError(Exception):
+    pass
+
+
+class _ThreadOutput(object):
+    """Replacement of sys.stdout sending output of every thread to its own sink.
+
+    Threads without a sink write to the original stream.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+
+    def set_sink(self, sink):
+        self._local.sink = sink
+
+    def write(self, data):
+        sink = getattr(self._local, "sink", None)
+        if sink is None:
+            return self._stream.write(data)
+        sink.write(data)
+        return len(data)
+
+    def flush(self):
+        if getattr(self._local, "sink", None) is None:
+            self._stream.flush()
+
+
+class _Build(object):
+    """Build running in the daemon and the clients waiting for it.
+
+    Output of the build is sent line by line to every client, clients joining
+    a running build get the output from the moment they joined.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self._clients = []
+        self._lock = threading.Lock()
+        self._line = ""
+
+    def join(self, client):
+        with self._lock:
+            self._clients.append(client)
+
+    def send(self, message):
+        with self._lock:
+            for client in list(self._clients):
+                try:
+                    client.send(message)
+                except OSError:
+                    # the client went away, the build goes on for the others
+                    self._clients.remove(client)
+
+    def write(self, data):
+        lines = (self._line + data).split("\n")
+        self._line = lines.pop()
+        for line in lines:
+            self.send({"type": "progress", "line": line})
+
+    def finish(self, result):
+        if self._line:
+            self.write("\n")
+        self.result = result
+        self.send(result)
+        self.done.set()
+
+
+class _Client(object):
+    def __init__(self, wfile):
+        self._wfile = wfile
+
+    def send(self, message):
+        self._wfile.write(json.dumps(message).encode() + b"\n")
+        self._wfile.flush()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        client = _Client(self.wfile)
+        try:
+            request = json.loads(self.rfile.readline().decode())
+            self.server.daemon.handle(request, client)
+        except (ValueError, DaemonError) as e:
+            client.send({"type": "result", "ok": False, "message": str(e)})
+        except OSError:
+            # the client disconnected
+            pass
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class BuildDaemon(object):
+    """Build images on requests received over a Unix socket.
+
+    The daemon keeps everything the single runs load again and again:
+    branches, resolved versions, ssh master connections to the servers,
+    staging directories with their manifests and the segment cache (and the
+    page cache of the files the builds read). A build costs only the changed
+    files then.
+
+    Requests resulting in the same image (same branch, sources and options)
+    which come while the image is built are joined to the running build.
+
+    branches     - mapping of the branch names to GeneralBranch instances
+    targets      - UploadTarget list
+    config       - mapping with anaconda_dir, projects_path, cache_dir (the
+                   work directories and the push record), cache (BuildSpec
+                   arguments of the build cache), images_dir,
+                   version_script, version_cache, tags (TagIndex or None),
+                   repo_base_url, resolver (RepodataResolver or None) and
+                   jobs
+    """
+
+    def __init__(self, socket_path, branches, targets, config):
+        self.socket_path = socket_path
+        self.branches = branches
+        self.targets = targets
+        self.config = config
+        self._builds = {}
+        self._builds_lock = threading.Lock()
+        # one build per staging directory at a time
+        self._branch_locks = {}
+        self._server = None
+
+    def _branch(self, name):
+        try:
+            return self.branches[name]
+        except KeyError:
+            raise DaemonError("Unknown branch '{}'".format(name))
+
+    def _branch_lock(self, branch):
+        with self._builds_lock:
+            return self._branch_locks.setdefault(branch.name, threading.Lock())
+
+    def _spec(self, request, branch):
+        projects = request.get("projects", [])
+        for project in projects:
+            if project not in PROJECTS:
+                raise DaemonError("Unknown project '{}'".format(project))
+
+        kwargs = {}
+        if request.get("compression"):
+            try:
+                kwargs["codec"], kwargs["level"] = parse_codec(request["compression"])
+            except CompressionError as e:
+                raise DaemonError(str(e))
+
+        img_name = request.get("image_name") or branch.img_name
+        return BuildSpec.from_branch(
+            branch, self.config["anaconda_dir"], os.path.join(self.config["images_dir"], img_name),
+            projects_path=self.config["projects_path"], projects=projects, tag=request.get("target") or None,
+            version_script=self.config["version_script"], version_cache=self.config["version_cache"],
+            tags=self.config.get("tags"), repo_base_url=self.config.get("repo_base_url", ""),
+            resolver=self.config.get("resolver"),
+            img_name=img_name, addons=request.get("addons", []), rpms=request.get("rpms", []),
+            jobs=self.config["jobs"],
+            work_dir=os.path.join(self.config["cache_dir"], "daemon", branch.name),
+            targets=[] if request.get("no_upload") else self.targets,
+            push_record=os.path.join(self.config["cache_dir"], "pushed.json"),
+            force_upload=request.get("force_upload", False), **self.config["cache"], **kwargs)
+
+    def _run_build(self, spec, branch, running):
+        # clients waiting for the build always get a result, whatever happens
+        message = {"type": "result", "ok": False, "message": "Build was interrupted"}
+        sys.stdout.set_sink(running)
+        try:
+            with self._branch_lock(branch):
+                result = build(spec)
+        except (ImageBuildError, UploadError, OSError, ValueError) as e:
+            message = {"type": "result", "ok": False, "message": str(e)}
+        except Exception as e:
+            traceback.print_exc()
+            message = {"type": "result", "ok": False, "message": "Unexpected error: {!r}".format(e)}
+        else:
+            message = {"type": "result", "ok": result.ok, "image": result.image_path,
+                       "size": result.size, "cached": result.cached,
+                       "seconds": round(result.seconds, 3),
+                       "uploads": [str(upload) for upload in result.uploads]}
+        finally:
+            sys.stdout.set_sink(None)
+            running.finish(message)
+
+    def build(self, request, client):
+        branch = self._branch(request.get("branch"))
+        try:
+            spec = self._spec(request, branch)
+            key = (spec.key(), spec.img_name, bool(spec.targets), spec.force_upload)
+        except (OSError, ValueError, subprocess.SubprocessError, RepodataError, TagIndexError) as e:
+            raise DaemonError(str(e))
+
+        with self._builds_lock:
+            running = self._builds.get(key)
+            leader = running is None
+            if leader:
+                running = self._builds[key] = _Build()
+            running.join(client)
+
+        if not leader:
+            client.send({"type": "progress", "line": "Joined the same build requested by another client"})
+            running.done.wait()
+            return
+
+        try:
+            self._run_build(spec, branch, running)
+        finally:
+            with self._builds_lock:
+                del self._builds[key]
+
+    def push(self, request, client):
+        branch = self._branch(request.get("branch"))
+        name = request.get("image_name") or branch.img_name
+        path = os.path.join(self.config["images_dir"], name)
+        if not os.path.exists(path):
+            raise DaemonError("There is no image {}".format(path))
+
+        record = PushRecord(os.path.join(self.config["cache_dir"], "pushed.json"))
+        record.load()
+        results = upload_file(path, name, self.targets, record, force=request.get("force_upload", False))
+        client.send({"type": "result", "ok": all(result.ok for result in results), "image": path,
+                     "uploads": [str(result) for result in results]})
+
+    def handle(self, request, client):
+        command = request.get("command")
+        if command == "build":
+            self.build(request, client)
+        elif command == "push":
+            self.push(request, client)
+        elif command == "ping":
+            client.send({"type": "result", "ok": True, "pid": os.getpid()})
+        elif command == "stop":
+            client.send({"type": "result", "ok": True})
+            threading.Thread(target=self._server.shutdown).start()
+        else:
+            raise DaemonError("Unknown command '{}'".format(command))
+
+    def serve(self):
+        if os.path.exists(self.socket_path):
+            try:
+                request(self.socket_path, {"command": "ping"})
+            except OSError:
+                # left behind by a daemon which didn't exit cleanly
+                os.unlink(self.socket_path)
+            else:
+                raise DaemonError("Daemon is already running on {}".format(self.socket_path))
+
+        os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+        self._server = _UnixServer(self.socket_path, _RequestHandler)
+        self._server.daemon = self
+        os.chmod(self.socket_path, 0o600)
+        sys.stdout = _ThreadOutput(sys.stdout)
+
+        try:
+            self._server.serve_forever()
+        finally:
+            sys.stdout = sys.stdout._stream
+            self._server.server_close()
+            os.unlink(self.socket_path)
+
+
+def request(socket_path, message, output=None):
+    """Send the request to the daemon, write its progress to the output and return the result."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(message).encode() + b"\n")
+
+        with sock.makefile("rb") as f:
+            for line in f:
+                response = json.loads(line.decode())
+                if response["type"] == "result":
+                    return response
+                if output is not None:
+                    print(response["line"], file=output, flush=True)
+
+    raise DaemonError("Daemon closed the connection without a result")
@@ -0,0 +1,472 @@
+import os
+import time
+import shutil
+import zlib
+import hashlib
+import subprocess
+
+from argparse import ArgumentParser
+from contextlib import contextmanager
+
+from anaconda_updates.atomic import load_json, store_json
+from anaconda_updates.compress import open_compressor, DEFAULT_CODEC
+from anaconda_updates.cpio import CpioWriter, CpioReader, CHUNK_SIZE
+from anaconda_updates.rpmpayload import open_payload
+from anaconda_updates.staging import file_hash
+from anaconda_updates.upload import TeeWriter
+
+# Where files from the anaconda repository are placed in the image.
+# First matching prefix wins, files without a match are skipped.
+INSTALL_PATHS = (
+    ("pyanaconda/", "run/install/updates/pyanaconda/"),
+    ("anaconda.py", "usr/sbin/anaconda"),
+    ("data/systemd/", "usr/lib/systemd/system/"),
+    ("dracut/", "usr/lib/dracut/modules.d/80anaconda/"),
+    ("data/", "usr/share/anaconda/"),
+)
+
+# Image paths of the projects staged by Executor.prepare, each is a segment
+PROJECT_SEGMENTS = (
+    ("blivet", "run/install/updates/blivet/"),
+    ("pykickstart", "run/install/updates/pykickstart/"),
+    ("simpleline", "run/install/updates/simpleline/"),
+)
+ADDONS_PATH = "usr/share/anaconda/addons/"
+# parts of the updates folder staged from the projects and addons
+STAGED_PATHS = tuple(path.rstrip("/") for _, path in PROJECT_SEGMENTS) + (ADDONS_PATH.rstrip("/"),)
+
+# change when the segment content changes for the same input
+SEGMENT_FORMAT = 1
+
+# limits of the delta chain, it is compacted to a full image when exceeded
+DELTA_MAX_SEGMENTS = 16
+DELTA_MAX_GROWTH = 1.5
+
+
+class ImageBuildError(Exception):
+    pass
+
+
+class PhaseTimer(object):
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, time.monotonic() - start)
+
+    def add(self, name, seconds):
+        self.phases.append((name, seconds))
+
+    def __str__(self):
+        return ", ".join("{} {:.3f}s".format(name, seconds) for name, seconds in self.phases)
+
+
+def parse_makeupdates_args(args):
+    """Parse arguments created for the makeupdates script.
+
+    Returns namespace of the supported arguments and a list of the rest.
+    """
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument("-k", dest="keep", action="store_true")
+    parser.add_argument("-c", dest="compile", action="store_true")
+    parser.add_argument("-t", dest="tag", default="HEAD")
+    parser.add_argument("-a", dest="rpms", action="append", default=[])
+    return parser.parse_known_args(args)
+
+
+def install_path(git_path):
+    for prefix, target in INSTALL_PATHS:
+        if git_path == prefix:
+            return target
+        if prefix.endswith("/") and git_path.startswith(prefix):
+            return target + git_path[len(prefix):]
+    return None
+
+
+def clean_updates_dir(updates_dir):
+    """Remove everything from the updates folder except the staged projects and addons.
+
+    The staged trees are kept, so the next build copies only what changed
+    in them.
+    """
+    for dir_path, dir_names, file_names in os.walk(updates_dir, topdown=False):
+        rel_path = os.path.relpath(dir_path, updates_dir)
+        if any(rel_path == path or rel_path.startswith(path + "/") for path in STAGED_PATHS):
+            continue
+
+        for name in file_names + [name for name in dir_names if os.path.islink(os.path.join(dir_path, name))]:
+            os.unlink(os.path.join(dir_path, name))
+        if dir_path != updates_dir and not os.listdir(dir_path):
+            os.rmdir(dir_path)
+
+
+def segment_name(image_path):
+    for name, prefix in PROJECT_SEGMENTS:
+        if image_path.startswith(prefix):
+            return name
+
+    if image_path.startswith(ADDONS_PATH):
+        addon = image_path[len(ADDONS_PATH):].split("/", 1)[0]
+        return "addon-" + addon
+
+    return "anaconda"
+
+
+class Segment(object):
+    """Part of the image created from a group of files or from one RPM."""
+
+    def __init__(self, name, files=None, rpm=None, rpm_index=0):
+        self.name = name
+        self.files = files or {}
+        self.rpm = rpm
+        self.rpm_index = rpm_index
+
+    def key(self, codec, level):
+        digest = hashlib.sha256()
+        digest.update(repr((SEGMENT_FORMAT, self.name, codec, level)).encode())
+
+        if self.rpm:
+            digest.update(repr((self.rpm_index, file_hash(self.rpm))).encode())
+
+        for name in sorted(self.files):
+            path = self.files[name]
+            st = os.stat(path)
+            digest.update(repr((name, st.st_mode, int(st.st_mtime), file_hash(path))).encode())
+
+        return digest.hexdigest()
+
+    def writer(self, fileobj):
+        # inode numbers have to differ between segments, otherwise
+        # directories of different segments look like hard links
+        return CpioWriter(fileobj, first_ino=(zlib.crc32(self.name.encode()) & 0xfff) << 20)
+
+    def write(self, fileobj):
+        writer = self.writer(fileobj)
+        if self.rpm:
+            self._write_rpm(writer)
+        else:
+            self._write_files(writer)
+        return writer.size
+
+    def _write_files(self, writer):
+        directories = set()
+        for name in self.files:
+            parent = os.path.dirname(name)
+            while parent and parent not in directories:
+                directories.add(parent)
+                parent = os.path.dirname(parent)
+
+        writer.add_directory(".")
+        for name in sorted(directories | self.files.keys()):
+            if name in self.files:
+                writer.add_file("./" + name, self.files[name])
+            else:
+                writer.add_directory("./" + name)
+
+    def _write_rpm(self, writer):
+        with open_payload(self.rpm) as payload:
+            for entry, data in CpioReader(payload):
+                if entry.name in (".", "./"):
+                    continue
+                # keep hard links of one package together but apart from the others
+                entry.devmajor = self.rpm_index + 1
+                writer.add_entry(entry, data)
+
+
+class ImageBuilder(object):
+    """Create updates image without the anaconda makeupdates script.
+
+    Files changed in the anaconda repository since the target tag, everything
+    staged in the updates directory and the content of the additional RPMs
+    are streamed as a newc cpio archive through the compressor directly to
+    the output file.
+
+    The archive is split to segments (anaconda, every project, addon and RPM)
+    compressed separately and concatenated, the installer decompresses them
+    as one cpio archive. With the cache (FileCache) every compressed segment is
+    stored under the hash of its content and reused while it doesn't change.
+
+    Without the tag only the updates directory and RPMs are archived.
+    """
+
+    def __init__(self, anaconda_dir, tag="HEAD", rpms=(), keep=True, jobs=1,
+                 codec=DEFAULT_CODEC, level=None, cache=None, updates_dir=None):
+        self.anaconda_dir = anaconda_dir
+        self.updates_dir = updates_dir or os.path.join(anaconda_dir, "updates")
+        self.tag = tag
+        self.rpms = list(rpms)
+        self.keep = keep
+        self.jobs = jobs
+        self.codec = codec
+        self.level = level
+        self.cache = cache
+        self.timer = PhaseTimer()
+        self._compress_time = 0.0
+
+    @classmethod
+    def from_command(cls, anaconda_dir, args, **kwargs):
+        nm, unknown = parse_makeupdates_args(args)
+        if nm.compile:
+            raise ImageBuildError("Compilation is not supported by the native image builder")
+        if unknown:
+            print("Ignoring makeupdates arguments:", " ".join(unknown))
+
+        return cls(anaconda_dir, tag=nm.tag, rpms=nm.rpms, keep=nm.keep, **kwargs)
+
+    def changed_files(self):
+        if self.tag is None:
+            return []
+
+        cmd = ["git", "-C", self.anaconda_dir, "diff", "--name-only", "--diff-filter=d", self.tag]
+        try:
+            out = subprocess.check_output(cmd, stderr=subprocess.STDOUT).decode()
+        except subprocess.CalledProcessError as e:
+            raise ImageBuildError("Can't list changes since {}: {}".format(self.tag, e.output.decode()))
+
+        return [line for line in out.splitlines() if line]
+
+    def collect(self):
+        """Return mapping of the image paths to the source files."""
+        files = {}
+        skipped = []
+
+        for git_path in self.changed_files():
+            target = install_path(git_path)
+            if target is None:
+                skipped.append(git_path)
+            else:
+                files[target] = os.path.join(self.anaconda_dir, git_path)
+
+        if skipped:
+            print("Skipping files not installed by the native builder:", " ".join(skipped))
+
+        if os.path.isdir(self.updates_dir):
+            for dir_path, _, file_names in os.walk(self.updates_dir, followlinks=True):
+                for file_name in file_names:
+                    path = os.path.join(dir_path, file_name)
+                    files[os.path.relpath(path, self.updates_dir)] = path
+
+        return files
+
+    def segments(self, files):
+        """Split the collected files and RPMs to the image segments."""
+        groups = {}
+
+        for name, path in files.items():
+            groups.setdefault(segment_name(name), {})[name] = path
+
+        segments = [Segment(name, files=group) for name, group in sorted(groups.items())]
+        for index, rpm in enumerate(self.rpms):
+            segments.append(Segment("rpm-{}-{}".format(index, os.path.basename(rpm)),
+                                    rpm=rpm, rpm_index=index))
+
+        return segments
+
+    def write_archive(self, fileobj, files):
+        size = 0
+
+        for segment in self.segments(files):
+            size += segment.write(fileobj)
+
+        writer = CpioWriter(fileobj)
+        writer.write_trailer()
+        return size + writer.size
+
+    def _compress(self, fileobj, write_func):
+        start = time.monotonic()
+        with open_compressor(fileobj, self.jobs, self.codec, self.level) as compressor:
+            write_func(compressor)
+        self._compress_time += time.monotonic() - start
+
+    def _write_segment(self, f_out, segment):
+        """Write compressed segment to the output, reuse it from the cache if possible."""
+        if self.cache is None:
+            self._compress(f_out, segment.write)
+            return False
+
+        key = segment.key(self.codec, self.level)
+        with self.cache.read(key) as f_segment:
+            if f_segment is not None:
+                shutil.copyfileobj(f_segment, f_out, CHUNK_SIZE)
+                return True
+
+        # write the new segment to the output and the cache at once
+        with self.cache.store(key) as f_segment:
+            self._compress(TeeWriter(f_out, f_segment), segment.write)
+
+        return False
+
+    def _write_image(self, output_path, files, upload=None):
+        """Write the image and return size of its trailer segment.
+
+        When upload is set, the image is sent to it while being written.
+        """
+        segments = self.segments(files)
+        self._compress_time = 0.0
+        built = []
+        reused = []
+
+        tmp_path = output_path + ".tmp"
+        with self.timer.phase("archive"):
+            try:
+                with open(tmp_path, "wb") as f_file:
+                    f_out = TeeWriter(f_file, upload) if upload else f_file
+                    for segment in segments:
+                        if self._write_segment(f_out, segment):
+                            reused.append(segment.name)
+                        else:
+                            built.append(segment.name)
+
+                    # the trailer is a segment on its own so the other segments
+                    # are one continuous cpio archive when decompressed
+                    trailer_start = f_out.tell()
+                    self._compress(f_out, lambda f: CpioWriter(f).write_trailer())
+                    trailer_size = f_out.tell() - trailer_start
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        # part of the archive phase spent in creating and compressing segments
+        self.timer.add("compress", self._compress_time)
+
+        os.replace(tmp_path, output_path)
+
+        if self.cache is not None:
+            self.cache.prune()
+
+        print("Segments built: {}".format(", ".join(built) or "none"))
+        print("Segments reused: {}".format(", ".join(reused) or "none"))
+        return trailer_size
+
+    def _finish(self, output_path, files):
+        if not self.keep and os.path.isdir(self.updates_dir):
+            clean_updates_dir(self.updates_dir)
+
+        print("Created {} ({} files, {} bytes compressed)".format(
+            output_path, len(files), os.path.getsize(output_path)))
+        print("Phase timings:", self.timer)
+
+    def build(self, output_path, upload=None):
+        with self.timer.phase("collect"):
+            files = self.collect()
+
+        self._write_image(output_path, files, upload)
+        self._finish(output_path, files)
+
+    def build_delta(self, output_path, chain_dir, upload=None):
+        """Append files changed since the last build to the image in the chain directory.
+
+        The chain is compacted to a fresh full image when it is not usable,
+        files were removed or it grew over the limits.
+        """
+        os.makedirs(chain_dir, exist_ok=True)
+        chain = DeltaChain(chain_dir)
+        chain.load()
+
+        with self.timer.phase("collect"):
+            files = self.collect()
+            entries, changed = chain.compare(files)
+
+        reason = chain.compaction_reason(self, entries)
+        self._compress_time = 0.0
+
+        if reason:
+            print("Creating full image:", reason)
+            trailer_size = self._write_image(chain.image_path, files)
+            chain.reset(self, trailer_size)
+        elif changed:
+            with self.timer.phase("append"):
+                segment = Segment("delta-{}".format(chain.state["segments"]),
+                                  files={name: files[name] for name in changed})
+                with open(chain.image_path, "r+b") as f_out:
+                    # cut the trailer at the size stored in the state, never at the end of
+                    # the file, so the state never points into a partially appended segment
+                    f_out.truncate(chain.state["image_size"] - chain.state["trailer_size"])
+                    f_out.seek(0, os.SEEK_END)
+                    self._compress(f_out, segment.write)
+                    self._compress(f_out, lambda f: CpioWriter(f).write_trailer())
+                chain.state["segments"] += 1
+                chain.state["image_size"] = os.path.getsize(chain.image_path)
+            print("Appended {} changed files to the delta chain".format(len(changed)))
+        else:
+            print("No files changed since the last build")
+
+        chain.state["files"] = entries
+        chain.save()
+
+        with open(chain.image_path, "rb") as f_in, open(output_path, "wb") as f_file:
+            f_out = TeeWriter(f_file, upload) if upload else f_file
+            shutil.copyfileobj(f_in, f_out, CHUNK_SIZE)
+        self._finish(output_path, files)
+
+
+class DeltaChain(object):
+    """Image made of a full image and appended segments with changed files.
+
+    Later cpio entries overwrite earlier ones when the image is unpacked, so
+    a changed file is simply appended without touching the rest of the image.
+    The state records the size of the complete image, an image of another
+    size (e.g. left by an interrupted append) is compacted.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.image_path = os.path.join(directory, "updates.img")
+        self.state_path = os.path.join(directory, "chain.json")
+        self.state = {}
+
+    def load(self):
+        self.state = load_json(self.state_path)
+
+    def save(self):
+        store_json(self.state_path, self.state)
+
+    def compare(self, files):
+        """Return state entries of the files and list of files changed since the last build."""
+        old_entries = self.state.get("files", {})
+        entries = {}
+        changed = []
+
+        for name, path in files.items():
+            st = os.stat(path)
+            old = old_entries.get(name)
+
+            if old and old[0] == st.st_size and old[1] == st.st_mtime_ns:
+                entries[name] = old
+                continue
+
+            entries[name] = [st.st_size, st.st_mtime_ns, file_hash(path)]
+            if not old or old[2] != entries[name][2]:
+                changed.append(name)
+
+        return entries, sorted(changed)
+
+    def _options(self, builder):
+        return [builder.codec, builder.level, [file_hash(rpm) for rpm in builder.rpms]]
+
+    def compaction_reason(self, builder, entries):
+        if not self.state or not os.path.exists(self.image_path):
+            return "no previous image"
+        if os.path.getsize(self.image_path) != self.state.get("image_size"):
+            # e.g. the last append was interrupted
+            return "the image doesn't match the chain state"
+        if self.state["options"] != self._options(builder):
+            return "compression or RPMs changed"
+        if self.state["files"].keys() - entries.keys():
+            return "files were removed"
+        if self.state["segments"] >= DELTA_MAX_SEGMENTS:
+            return "too many segments in the chain"
+        if os.path.getsize(self.image_path) > self.state["base_size"] * DELTA_MAX_GROWTH:
+            return "the chain grew too large"
+        return None
+
+    def reset(self, builder, trailer_size):
+        self.state = {"options": self._options(builder),
+                      "trailer_size": trailer_size,
+                      "image_size": os.path.getsize(self.image_path),
+                      "base_size": os.path.getsize(self.image_path),
+                      "segments": 0}
@@ -0,0 +1,60 @@
+import os
+import fcntl
+import subprocess
+
+
+class FileLock(object):
+    """Exclusive lock shared by processes, held as a lock on the file.
+
+    The lock is released by the kernel when the process dies, so a crashed
+    run never leaves a stale lock behind.
+    """
+
+    def __init__(self, path, description=None):
+        self.path = path
+        self.description = description or path
+        self._fd = None
+
+    def acquire(self):
+        """Take the lock, wait while somebody else holds it."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o664)
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print("Waiting for another build using {}".format(self.description))
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            except BaseException:
+                os.close(fd)
+                raise
+
+        self._fd = fd
+
+    def release(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+def checkout_lock_path(checkout_dir, fallback_dir):
+    """Return path of the lock file of the checkout.
+
+    The lock is in the git directory of the checkout so it works for every
+    user of the checkout. Directories which aren't git checkouts have their
+    lock in the fallback directory.
+    """
+    try:
+        git_dir = subprocess.check_output(["git", "-C", checkout_dir, "rev-parse", "--absolute-git-dir"],
+                                          stderr=subprocess.DEVNULL).decode().strip()
+    except subprocess.CalledProcessError:
+        return os.path.join(fallback_dir, os.path.basename(checkout_dir) + ".lock")
+    return os.path.join(git_dir, "anaconda-updates.lock")
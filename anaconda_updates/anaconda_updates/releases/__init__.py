@@ -1,80 +1,177 @@
-__all__ = ["Branch", "GeneralBranch", "master",
-           "f22", "f23", "f24", "f25", "f26", "f27", "f28", "f29", "f30", "f31",
-           "rhel6", "rhel6_8",
-           "rhel7", "rhel7_1", "rhel7_2", "rhel7_3", "rhel7_4", "rhel7_5", "rhel7_6",
-           "rhel8"]
-
 import subprocess
 import os
+import configparser
 
-from enum import Enum
+from functools import lru_cache
 from anaconda_updates.settings import GlobalSettings
+from anaconda_updates.releases.versions import VersionCache
+
+# declarative table of all branches, see the file for the format
+BRANCHES_PATH = os.path.join(os.path.dirname(__file__), "branches.cfg")
+# seconds the show version script may run
+VERSION_SCRIPT_TIMEOUT = 60
+
+_resolver = None
+
+
+def repodata_resolver():
+    """Return the resolver shared by all branches, it keeps the connections open."""
+    global _resolver
+    if _resolver is None:
+        # imported here, most runs don't need it
+        from anaconda_updates.releases.repodata import RepodataResolver
+        _resolver = RepodataResolver(os.path.join(os.path.expanduser(GlobalSettings.CACHE_PATH), "repodata.json"))
+    return _resolver
+
+
+@lru_cache(maxsize=None)
+def branch_table(path=BRANCHES_PATH):
+    """Return the branch table, it is read only once."""
+    table = configparser.ConfigParser(interpolation=None)
+    with open(path) as f:
+        table.read_file(f)
+    return table
+
+
+def branch_options():
+    """Return (name, command line options, help) of every branch.
+
+    This is everything the command line needs, no branch is created.
+    """
+    table = branch_table()
+    return [(name, table[name]["options"].split(), table[name]["help"]) for name in table.sections()]
+
+
+def branch_names(name):
+    """Return all names of the branch: its options without dashes and its name."""
+    return [option.lstrip("-") for option in branch_table()[name]["options"].split()] + [name]
 
 
-class Branch(Enum):
-    Nothing  = 0,
+def find_branch(name):
+    """Return name of the branch called by any of its names, raise ValueError for an unknown name."""
+    for branch_name in branch_table().sections():
+        if name in branch_names(branch_name):
+            return branch_name
+    raise ValueError("Unknown branch '{}'".format(name))
 
-    master   = 1,
-    fedora22 = 2,
-    fedora23 = 3,
-    fedora24 = 4,
-    fedora25 = 5,
-    fedora26 = 6,
-    fedora27 = 7,
-    fedora28 = 8,
-    fedora29 = 9,
-    fedora30 = 10,
-    fedora31 = 11,
 
-    rhel6    = 50,
-    rhel6_8  = 51,
+def create_branch(name):
+    """Return GeneralBranch of the branch with the name (see find_branch)."""
+    section = branch_table()[name]
+    kwargs = {}
 
-    rhel7    = 100,
-    rhel7_1  = 101,
-    rhel7_2  = 102,
-    rhel7_3  = 103,
-    rhel7_4  = 104,
-    rhel7_5  = 105,
-    rhel7_6  = 106,
+    for key in ("version", "repo_path", "img_name", "default_codec"):
+        if key in section:
+            kwargs[key] = section[key]
+    for key in ("version_script_params", "mkupdates_args", "blivet_args", "pykickstart_args",
+                "simpleline_args", "without_projects", "codecs"):
+        if key in section:
+            kwargs[key] = section[key].split()
 
-    rhel8    = 200,
+    return GeneralBranch(name, section["options"].split(), section["help"], **kwargs)
+
+
+def all_branches():
+    return [create_branch(name) for name in branch_table().sections()]
 
 
 class GeneralBranch(object):
-    def __init__(self, branch_type,
+    """Branch of anaconda, created from the branch table by create_branch()."""
+
+    def __init__(self, name,
                  cmd_args, help,
-                 version="", version_script_params=[], img_name="master_updates.img",
-                 mkupdates_args=[],
-                 blivet_args=[],
-                 pykickstart_args=[],
-                 simpleline_args=[]):
-
-        self.type = branch_type
-        self.cmd_args = cmd_args
+                 version="", version_script_params=(), repo_path="", img_name="master_updates.img",
+                 mkupdates_args=(),
+                 blivet_args=(),
+                 pykickstart_args=(),
+                 simpleline_args=(),
+                 without_projects=(),
+                 codecs=("gzip", "xz", "none"),
+                 default_codec="gzip"):
+
+        self.name = name
+        self.cmd_args = list(cmd_args)
         self.help = help
         self._version = version
         self.img_name = img_name
-        self.input_args = mkupdates_args
-        self.blivet_args = blivet_args
-        self.pykickstart_args = pykickstart_args
-        self.simpleline_args = simpleline_args
-        self.show_version_params = version_script_params
+        self.input_args = list(mkupdates_args)
+        self.blivet_args = list(blivet_args)
+        self.pykickstart_args = list(pykickstart_args)
+        self.simpleline_args = list(simpleline_args)
+        self.without_projects = list(without_projects)
+        self.show_version_params = list(version_script_params)
+        self.repo_path = repo_path
+        self.codecs = list(codecs)
+        self.default_codec = default_codec
+
+    def apply_settings(self):
+        """Turn off the projects the branch can't use, call it for the branch which is built."""
+        for project in self.without_projects:
+            setattr(GlobalSettings, "use_" + project, False)
 
     @property
     def version(self):
-        if self._version:
+        cache = VersionCache(os.path.join(os.path.expanduser(GlobalSettings.CACHE_PATH), "versions.json"),
+                             GlobalSettings.version_cache_ttl, GlobalSettings.refresh_versions)
+        return self.resolve_version(cache=cache)
+
+    def resolve_version(self, script_path=None, cache=None, tags=None, rev="HEAD", repo_base_url=None,
+                        resolver=None):
+        """Return the anaconda version of the branch.
+
+        Versions found by the script (or in the repository) are kept in the
+        VersionCache if given. With the TagIndex the version is taken from
+        the release tags reachable from the revision instead. The script path,
+        the base URL of the repositories and the RepodataResolver are taken
+        from GlobalSettings when they are None.
+        """
+        if tags is not None:
+            return tags.version(rev, self._version)
+        elif self._version:
             return self._version
+        elif cache is not None:
+            ver = cache.get(self.version_key(script_path, repo_base_url),
+                            lambda: self.get_version(script_path, repo_base_url, resolver))
         else:
-            ver = self.get_version()
-            if not ver:
-                raise ValueError("Anaconda version is not known")
+            ver = self.get_version(script_path, repo_base_url, resolver)
+
+        if not ver:
+            raise ValueError("Anaconda version is not known")
+
+        return ver
+
+    def version_source(self, script_path=None, repo_base_url=None):
+        """Return where the version is looked up: the repository or the script with its arguments."""
+        repo_url = self.repo_url(repo_base_url)
+        if repo_url:
+            return repo_url
+        return " ".join([self._version_script(script_path), *self.show_version_params])
+
+    def version_key(self, script_path=None, repo_base_url=None):
+        return " ".join([self.name, self.version_source(script_path, repo_base_url)])
+
+    def repo_url(self, base_url=None):
+        """URL of the repository with anaconda of this branch, empty when the script is used."""
+        if base_url is None:
+            base_url = GlobalSettings.repo_base_url
+        if not base_url or not self.repo_path:
+            return ""
+        return "/".join([base_url.rstrip("/"), self.repo_path])
 
-            return ver
+    @staticmethod
+    def _version_script(script_path=None):
+        if script_path is None:
+            script_path = GlobalSettings.show_version_script_path
+        return os.path.expanduser(script_path)
 
-    def add_argument(self, parse_args):
-        parse_args.add_branch_param(*self.cmd_args, const_val=self.type,
-                                    help=self.help)
+    def get_version(self, script_path=None, repo_base_url=None, resolver=None):
+        repo_url = self.repo_url(repo_base_url)
+        if repo_url:
+            _epoch, version, _release = (resolver or repodata_resolver()).resolve(repo_url)
+            return version
 
-    def get_version(self):
-        path = os.path.expanduser(GlobalSettings.show_version_script_path)
-        return subprocess.check_output([path, *self.show_version_params]).decode()[:-1]
+        path = self._version_script(script_path)
+        if not path:
+            raise ValueError("Path of the show version script is not set")
+        return subprocess.check_output([path, *self.show_version_params],
+                                       timeout=VERSION_SCRIPT_TIMEOUT).decode()[:-1]
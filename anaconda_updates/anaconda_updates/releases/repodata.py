@@ -0,0 +1,271 @@
+import gzip
+import lzma
+import string
+import threading
+import http.client
+
+from urllib.parse import urljoin, urlsplit
+from xml.etree import ElementTree
+
+from anaconda_updates.atomic import locked, load_json, store_json
+
+REPO_NS = "{http://linux.duke.edu/metadata/repo}"
+COMMON_NS = "{http://linux.duke.edu/metadata/common}"
+
+HTTP_TIMEOUT = 60
+
+_ALNUM = frozenset(string.ascii_letters + string.digits)
+
+
+class RepodataError(Exception):
+    pass
+
+
+def rpm_vercmp(a, b):
+    """Compare two version (or release) strings the way rpm does.
+
+    Return 1 when a is newer, -1 when b is newer and 0 when they are equal.
+    Segments of digits are compared as numbers, segments of letters as
+    strings and a number is newer than letters. "~" sorts before anything,
+    even the end of the string, "^" sorts after the end of the string but
+    before anything else.
+    """
+    if a == b:
+        return 0
+
+    i = j = 0
+    while i < len(a) or j < len(b):
+        while i < len(a) and a[i] not in _ALNUM and a[i] not in "~^":
+            i += 1
+        while j < len(b) and b[j] not in _ALNUM and b[j] not in "~^":
+            j += 1
+
+        if (i < len(a) and a[i] == "~") or (j < len(b) and b[j] == "~"):
+            if i >= len(a) or a[i] != "~":
+                return 1
+            if j >= len(b) or b[j] != "~":
+                return -1
+            i += 1
+            j += 1
+            continue
+
+        if (i < len(a) and a[i] == "^") or (j < len(b) and b[j] == "^"):
+            if i >= len(a):
+                return -1
+            if j >= len(b):
+                return 1
+            if a[i] != "^":
+                return 1
+            if b[j] != "^":
+                return -1
+            i += 1
+            j += 1
+            continue
+
+        if i >= len(a) or j >= len(b):
+            break
+
+        chars = string.digits if a[i].isdigit() else string.ascii_letters
+        start_a, start_b = i, j
+        while i < len(a) and a[i] in chars:
+            i += 1
+        while j < len(b) and b[j] in chars:
+            j += 1
+        segment_a, segment_b = a[start_a:i], b[start_b:j]
+
+        if not segment_b:
+            # numbers are newer than letters
+            return 1 if chars == string.digits else -1
+
+        if chars == string.digits:
+            segment_a = segment_a.lstrip("0")
+            segment_b = segment_b.lstrip("0")
+            if len(segment_a) != len(segment_b):
+                return 1 if len(segment_a) > len(segment_b) else -1
+
+        if segment_a != segment_b:
+            return 1 if segment_a > segment_b else -1
+
+    if i >= len(a) and j >= len(b):
+        return 0
+    # the one with something left is newer
+    return -1 if i >= len(a) else 1
+
+
+def evr_cmp(evr_a, evr_b):
+    """Compare (epoch, version, release) tuples, see rpm_vercmp."""
+    epoch_a, epoch_b = int(evr_a[0] or 0), int(evr_b[0] or 0)
+    if epoch_a != epoch_b:
+        return 1 if epoch_a > epoch_b else -1
+
+    return rpm_vercmp(evr_a[1], evr_b[1]) or rpm_vercmp(evr_a[2], evr_b[2])
+
+
+def newest_package(stream, name):
+    """Return (epoch, version, release) of the newest binary package in primary.xml.
+
+    The file is parsed as a stream, every package is dropped as soon as it
+    is read, so memory doesn't grow with the size of the repository.
+    """
+    newest = None
+    root = None
+
+    for event, elem in ElementTree.iterparse(stream, events=("start", "end")):
+        if root is None:
+            root = elem
+        if event != "end" or elem.tag != COMMON_NS + "package":
+            continue
+
+        if elem.findtext(COMMON_NS + "name") == name and elem.findtext(COMMON_NS + "arch") != "src":
+            version = elem.find(COMMON_NS + "version")
+            evr = (version.get("epoch"), version.get("ver"), version.get("rel"))
+            if newest is None or evr_cmp(evr, newest) > 0:
+                newest = evr
+
+        root.clear()
+
+    return newest
+
+
+class RepodataResolver(object):
+    """Find the newest version of a package in yum repositories.
+
+    Only repomd.xml is requested on every lookup, conditionally (ETag and
+    Last-Modified of the last response are sent back), so an unchanged
+    repository costs one small request answered by "304 Not Modified".
+    The primary metadata is downloaded and parsed only when repomd.xml
+    points to a new one. Connections are kept open for the next lookups of
+    the same thread.
+
+    state_path - JSON file with the validators and results of the last lookups
+    """
+
+    def __init__(self, state_path):
+        self.state_path = state_path
+        self._local = threading.local()
+
+    def _store(self, url, entry):
+        with locked(self.state_path):
+            state = load_json(self.state_path)
+            state[url] = entry
+            store_json(self.state_path, state, indent=1, sort_keys=True)
+
+    def _connection(self, scheme, netloc):
+        connections = self._local.__dict__.setdefault("connections", {})
+        conn = connections.get((scheme, netloc))
+        if conn is None:
+            if scheme == "https":
+                conn = http.client.HTTPSConnection(netloc, timeout=HTTP_TIMEOUT)
+            elif scheme == "http":
+                conn = http.client.HTTPConnection(netloc, timeout=HTTP_TIMEOUT)
+            else:
+                raise RepodataError("Unsupported repository URL scheme '{}'".format(scheme))
+            connections[(scheme, netloc)] = conn
+        return conn
+
+    def _request(self, url, headers=None):
+        """Send GET request over the kept connection and return the response.
+
+        A connection closed by the server since the last request is opened
+        again once.
+        """
+        parts = urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        headers = dict(headers or {}, **{"Accept-Encoding": "identity"})
+
+        for retry in (False, True):
+            conn = self._connection(parts.scheme, parts.netloc)
+            try:
+                conn.request("GET", path, headers=headers)
+                return conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if retry:
+                    raise
+            except OSError:
+                conn.close()
+                raise
+
+    def _finish(self, url, response):
+        """Close the response so the connection can be reused.
+
+        Short bodies (errors, 304) are read to the end, a connection with an
+        unread body (e.g. parsing failed) is closed.
+        """
+        if response.status != 200:
+            response.read()
+        if not response.isclosed():
+            parts = urlsplit(url)
+            self._connection(parts.scheme, parts.netloc).close()
+        response.close()
+
+    def _primary_location(self, repomd):
+        for data in repomd.iter(REPO_NS + "data"):
+            if data.get("type") == "primary":
+                location = data.find(REPO_NS + "location")
+                if location is not None:
+                    return location.get("href")
+        raise RepodataError("There is no primary metadata in repomd.xml")
+
+    def _read_primary(self, url, name):
+        response = self._request(url)
+        try:
+            if response.status != 200:
+                raise RepodataError("Can't download {}: {} {}".format(url, response.status, response.reason))
+
+            if url.endswith(".gz"):
+                stream = gzip.GzipFile(fileobj=response)
+            elif url.endswith(".xz"):
+                stream = lzma.LZMAFile(response)
+            elif url.endswith(".xml"):
+                stream = response
+            else:
+                raise RepodataError("Unsupported compression of {}".format(url))
+
+            evr = newest_package(stream, name)
+        finally:
+            self._finish(url, response)
+
+        if evr is None:
+            raise RepodataError("There is no {} package in {}".format(name, url))
+        return evr
+
+    def resolve(self, repo_url, name="anaconda"):
+        """Return (epoch, version, release) of the newest package in the repository."""
+        repo_url = repo_url.rstrip("/") + "/"
+        repomd_url = urljoin(repo_url, "repodata/repomd.xml")
+        entry = load_json(self.state_path).get(repomd_url, {})
+
+        headers = {}
+        if entry.get("name") == name:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        try:
+            response = self._request(repomd_url, headers)
+            try:
+                if response.status == 304 and headers:
+                    return tuple(entry["evr"])
+                if response.status != 200:
+                    raise RepodataError("Can't download {}: {} {}".format(repomd_url, response.status,
+                                                                         response.reason))
+                repomd = ElementTree.parse(response).getroot()
+            finally:
+                self._finish(repomd_url, response)
+
+            primary_url = urljoin(repo_url, self._primary_location(repomd))
+            if entry.get("name") == name and entry.get("primary") == primary_url:
+                evr = tuple(entry["evr"])
+            else:
+                evr = self._read_primary(primary_url, name)
+        except (OSError, EOFError, lzma.LZMAError, http.client.HTTPException, ElementTree.ParseError) as e:
+            raise RepodataError("Can't read repository {}: {}".format(repo_url, e))
+
+        self._store(repomd_url, {"name": name, "primary": primary_url, "evr": list(evr),
+                                 "etag": response.getheader("ETag"),
+                                 "last_modified": response.getheader("Last-Modified")})
+        return evr
@@ -0,0 +1,180 @@
+import os
+import re
+import string
+import subprocess
+
+from functools import cmp_to_key
+
+from anaconda_updates.atomic import load_json, store_json
+from anaconda_updates.releases.repodata import rpm_vercmp
+
+# tags the updates images are created from, "anaconda-<version>-1"
+RELEASE_TAG = re.compile(r"^anaconda-(?P<version>.+)-1$")
+
+
+class TagIndexError(Exception):
+    pass
+
+
+def _is_sha(rev):
+    return len(rev) == 40 and all(c in string.hexdigits for c in rev)
+
+
+class TagIndex(object):
+    """Anaconda versions of commits taken from the release tags of a local checkout.
+
+    The release tags are read by one "git for-each-ref" and kept in the index
+    file together with the versions found for commits. The index is read
+    again only when the tags change (packed-refs or refs/tags is modified),
+    HEAD is read directly from the git directory, so a repeated lookup needs
+    no git process at all.
+
+    checkout_dir - anaconda checkout (or its worktree)
+    index_path   - JSON file with the index
+    """
+
+    def __init__(self, checkout_dir, index_path):
+        self.checkout_dir = checkout_dir
+        self.index_path = index_path
+        self._git_dir, self._common_dir = self._git_dirs(checkout_dir)
+        self._index = None
+
+    @staticmethod
+    def _git_dirs(checkout_dir):
+        """Return the git directory of the checkout and the directory with refs shared by worktrees."""
+        git_dir = os.path.join(checkout_dir, ".git")
+        if os.path.isfile(git_dir):
+            # worktree, .git points to its directory in the main repository
+            with open(git_dir) as f:
+                git_dir = os.path.join(checkout_dir, f.read().strip()[len("gitdir: "):])
+        elif not os.path.isdir(git_dir):
+            raise TagIndexError("{} is not a git checkout".format(checkout_dir))
+
+        common_dir = git_dir
+        if os.path.isfile(os.path.join(git_dir, "commondir")):
+            with open(os.path.join(git_dir, "commondir")) as f:
+                common_dir = os.path.normpath(os.path.join(git_dir, f.read().strip()))
+
+        return git_dir, common_dir
+
+    def _git(self, *args):
+        try:
+            return subprocess.check_output(["git", "-C", self.checkout_dir, *args],
+                                           stderr=subprocess.DEVNULL).decode()
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise TagIndexError("git {} failed: {}".format(args[0], e))
+
+    def _signature(self):
+        """Return what changes with the tags: stat of packed-refs and of the loose tags directory."""
+        signature = []
+        for path in ("packed-refs", os.path.join("refs", "tags")):
+            try:
+                st = os.stat(os.path.join(self._common_dir, path))
+                signature.append([st.st_mtime_ns, st.st_size])
+            except FileNotFoundError:
+                signature.append(None)
+        return signature
+
+    def _packed_ref(self, ref):
+        try:
+            with open(os.path.join(self._common_dir, "packed-refs")) as f:
+                for line in f:
+                    if line.endswith(" " + ref + "\n"):
+                        return line.split(" ", 1)[0]
+        except FileNotFoundError:
+            pass
+        return None
+
+    def _read_ref(self, ref):
+        if ref == "HEAD":
+            path = os.path.join(self._git_dir, "HEAD")
+        else:
+            path = os.path.join(self._common_dir, ref)
+
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except (FileNotFoundError, IsADirectoryError):
+            return self._packed_ref(ref)
+
+        if value.startswith("ref: "):
+            return self._read_ref(value[len("ref: "):])
+        return value
+
+    def resolve(self, rev="HEAD"):
+        """Return the commit of the revision."""
+        if _is_sha(rev):
+            return rev
+        sha = self._read_ref(rev) if rev == "HEAD" else None
+        if sha is None:
+            sha = self._git("rev-parse", "--verify", "--quiet", rev + "^{commit}").strip()
+        if not sha:
+            raise TagIndexError("Unknown revision {}".format(rev))
+        return sha
+
+    def _load(self):
+        signature = self._signature()
+        if self._index is not None and self._index["signature"] == signature:
+            return self._index
+
+        index = load_json(self.index_path)
+        if index.get("signature") != signature:
+            tags = {}
+            output = self._git("for-each-ref", "--format=%(refname:strip=2) %(objectname) %(*objectname)",
+                               "refs/tags/anaconda-*")
+            for line in output.splitlines():
+                name, sha, peeled = (line.split(" ") + [""])[:3]
+                if RELEASE_TAG.match(name):
+                    # annotated tags point to the tag object, the commit is the peeled one
+                    tags[name] = peeled or sha
+            index = {"signature": signature, "tags": tags, "versions": {}}
+            self._store(index)
+
+        self._index = index
+        return index
+
+    def _store(self, index):
+        store_json(self.index_path, index, indent=1, sort_keys=True)
+
+    def _newest_reachable(self, sha):
+        names = [name for name in self._git("tag", "--merged", sha, "--list", "anaconda-*").split()
+                 if RELEASE_TAG.match(name)]
+        if not names:
+            return None
+        versions = [RELEASE_TAG.match(name).group("version") for name in names]
+        return max(versions, key=cmp_to_key(rpm_vercmp))
+
+    def _nearest_ancestor(self, sha, index):
+        try:
+            name = self._git("describe", "--tags", "--abbrev=0", "--match", "anaconda-*-1", sha).strip()
+        except TagIndexError:
+            return None
+        # of the tags of the same commit the newest one
+        commit = index["tags"].get(name)
+        versions = [RELEASE_TAG.match(tag).group("version")
+                    for tag, tag_commit in index["tags"].items() if tag_commit == commit]
+        return max(versions, key=cmp_to_key(rpm_vercmp)) if versions else RELEASE_TAG.match(name).group("version")
+
+    def version(self, rev="HEAD", wanted=None):
+        """Return the anaconda version the revision should be compared to.
+
+        The wanted version (e.g. the one of the branch definition) is
+        returned when its release tag exists. Without it the newest release
+        tag reachable from the revision is used. When the wanted tag is
+        missing, the release tag nearest to the revision is used instead.
+        """
+        index = self._load()
+        if wanted and "anaconda-{}-1".format(wanted) in index["tags"]:
+            return wanted
+
+        sha = self.resolve(rev)
+        key = "{} {}".format("nearest" if wanted else "newest", sha)
+        version = index["versions"].get(key)
+        if version is None:
+            version = self._nearest_ancestor(sha, index) if wanted else self._newest_reachable(sha)
+            if version is None:
+                raise TagIndexError("There is no release tag (anaconda-<version>-1) reachable from {}".format(rev))
+            index["versions"][key] = version
+            self._store(index)
+
+        return version
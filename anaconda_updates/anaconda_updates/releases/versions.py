@@ -0,0 +1,64 @@
+import sys
+import time
+import threading
+
+from anaconda_updates.atomic import locked, load_json, store_json
+
+DEFAULT_TTL = 60 * 60
+
+
+class VersionCache(object):
+    """Versions found by lookups (e.g. the show version script) kept on disk.
+
+    A fresh version is returned right away. A version older than the TTL is
+    returned right away too, but it is looked up again in the background
+    (stale while revalidate), so a later run gets the new one. The process
+    doesn't wait for the background lookup, when it exits first the next
+    run looks up again. Only unknown
+    versions, or all of them when refresh is set or the TTL is 0, wait for
+    the lookup. When the lookup fails, the cached version is used if there is
+    one.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, refresh=False):
+        self.path = path
+        self.ttl = ttl
+        self.refresh = refresh
+
+    def _store(self, key, version):
+        with locked(self.path):
+            entries = load_json(self.path)
+            entries[key] = {"version": version, "time": time.time()}
+            store_json(self.path, entries, indent=1, sort_keys=True)
+
+    def _lookup(self, key, lookup):
+        version = lookup()
+        if version:
+            self._store(key, version)
+        return version
+
+    def _revalidate(self, key, lookup):
+        try:
+            self._lookup(key, lookup)
+        except Exception as e:
+            print("Can't refresh version {}: {}".format(key, e), file=sys.stderr)
+
+    def get(self, key, lookup):
+        """Return version stored under the key, lookup is called to find it."""
+        entry = load_json(self.path).get(key)
+
+        if entry is None or self.refresh or self.ttl <= 0:
+            try:
+                return self._lookup(key, lookup)
+            except Exception as e:
+                if entry is None:
+                    raise
+                print("Can't look up version {}, using cached {}: {}".format(key, entry["version"], e),
+                      file=sys.stderr)
+                return entry["version"]
+
+        if time.time() - entry["time"] > self.ttl:
+            # daemon thread, a slow lookup must not hold the process at exit
+            threading.Thread(target=self._revalidate, args=(key, lookup), daemon=True).start()
+
+        return entry["version"]
@@ -0,0 +1,74 @@
+import bz2
+import gzip
+import lzma
+import struct
+import subprocess
+
+from contextlib import contextmanager
+
+RPM_LEAD_SIZE = 96
+HEADER_MAGIC = b"\x8e\xad\xe8\x01"
+RPMTAG_PAYLOADCOMPRESSOR = 1125
+
+_DECOMPRESSORS = {
+    "gzip": lambda f: gzip.GzipFile(fileobj=f, mode="rb"),
+    "xz": lzma.LZMAFile,
+    "lzma": lzma.LZMAFile,
+    "bzip2": bz2.BZ2File,
+}
+
+
+class RpmError(Exception):
+    pass
+
+
+def _read_header(f, align):
+    intro = f.read(16)
+    if len(intro) != 16 or intro[:4] != HEADER_MAGIC:
+        raise RpmError("Bad RPM header magic")
+
+    nindex, hsize = struct.unpack(">II", intro[8:16])
+    index = f.read(16 * nindex)
+    store = f.read(hsize)
+
+    if align:
+        f.read((8 - (16 + len(index) + hsize) % 8) % 8)
+
+    tags = {}
+    for i in range(nindex):
+        tag, tag_type, offset, count = struct.unpack(">IIII", index[i * 16:(i + 1) * 16])
+        tags[tag] = (tag_type, offset, count)
+
+    return tags, store
+
+
+def _string_tag(tags, store, tag, default=None):
+    if tag not in tags:
+        return default
+
+    offset = tags[tag][1]
+    return store[offset:store.index(b"\0", offset)].decode()
+
+
+@contextmanager
+def open_payload(path):
+    """Open a decompressed cpio payload of the RPM package."""
+    with open(path, "rb") as f:
+        f.seek(RPM_LEAD_SIZE)
+        _read_header(f, align=True)  # signature header
+        tags, store = _read_header(f, align=False)
+        compressor = _string_tag(tags, store, RPMTAG_PAYLOADCOMPRESSOR, "gzip")
+
+        if compressor in _DECOMPRESSORS:
+            with _DECOMPRESSORS[compressor](f) as payload:
+                yield payload
+            return
+
+    # not supported by the standard library (e.g. zstd), let rpm2cpio do the work
+    popen = subprocess.Popen(["rpm2cpio", path], stdout=subprocess.PIPE)
+    try:
+        yield popen.stdout
+    finally:
+        popen.stdout.close()
+        if popen.wait() != 0:
+            raise RpmError("rpm2cpio failed for {}".format(path))
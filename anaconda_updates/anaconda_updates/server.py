@@ -0,0 +1,171 @@
+import os
+import re
+import time
+import shutil
+import threading
+
+from urllib.parse import unquote, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHUNK_SIZE = 1024 * 1024
+IMAGE_SUFFIX = ".img"
+
+
+def etag(st):
+    # the image is replaced by rename, so a new image always has a new inode
+    return '"{:x}-{:x}-{:x}"'.format(st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def parse_range(header, size):
+    """Return (start, end) of the single byte range, end inclusive.
+
+    Returns None when the range can't be satisfied.
+    """
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+
+    if not match.group(1):
+        # suffix range, last N bytes
+        length = int(match.group(2))
+        if length == 0 or size == 0:
+            return None
+        return max(0, size - length), size - 1
+
+    start = int(match.group(1))
+    end = int(match.group(2)) if match.group(2) else size - 1
+    if start >= size or end < start:
+        return None
+
+    return start, min(end, size - 1)
+
+
+class ImageRequestHandler(BaseHTTPRequestHandler):
+    """Serve updates images from one directory.
+
+    Images are published under /<image name>. Every request opens the image
+    it serves, so an image swapped while a download is running doesn't
+    affect that download.
+    """
+
+    protocol_version = "HTTP/1.1"
+    server_version = "anaconda-updates"
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _send_empty(self, code, headers=()):
+        self.send_response(code)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _image_path(self):
+        name = unquote(urlsplit(self.path).path).lstrip("/")
+        if not name.endswith(IMAGE_SUFFIX) or "/" in name or name.startswith("."):
+            return None
+        return os.path.join(self.server.directory, name)
+
+    def _serve_index(self, send_body):
+        names = sorted(name for name in os.listdir(self.server.directory) if name.endswith(IMAGE_SUFFIX))
+        body = "".join(name + "\n" for name in names).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _serve(self, send_body):
+        if urlsplit(self.path).path == "/":
+            self._serve_index(send_body)
+            return
+
+        path = self._image_path()
+        try:
+            f = open(path, "rb") if path else None
+        except OSError:
+            f = None
+
+        if f is None:
+            self._send_empty(404)
+            return
+
+        with f:
+            st = os.fstat(f.fileno())
+            tag = etag(st)
+            headers = [("ETag", tag),
+                       ("Accept-Ranges", "bytes"),
+                       ("Last-Modified", self.date_time_string(st.st_mtime)),
+                       ("Content-Type", "application/octet-stream")]
+
+            if_none_match = self.headers.get("If-None-Match")
+            if if_none_match and (if_none_match.strip() == "*" or
+                                  tag in [t.strip() for t in if_none_match.split(",")]):
+                self._send_empty(304, headers)
+                return
+
+            start, end = 0, st.st_size - 1
+            code = 200
+            range_header = self.headers.get("Range")
+            if range_header and self.headers.get("If-Range", tag) == tag:
+                byte_range = parse_range(range_header, st.st_size)
+                if byte_range is None:
+                    self._send_empty(416, [("Content-Range", "bytes */{}".format(st.st_size))])
+                    return
+                start, end = byte_range
+                code = 206
+                headers.append(("Content-Range", "bytes {}-{}/{}".format(start, end, st.st_size)))
+
+            length = end - start + 1
+            self.send_response(code)
+            for name, value in headers:
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(length))
+            self.end_headers()
+
+            if send_body:
+                self._send_file(f, start, length)
+
+    def _send_file(self, f, start, length):
+        begin = time.monotonic()
+        f.seek(start)
+        remaining = length
+
+        while remaining:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            self.wfile.write(chunk)
+            remaining -= len(chunk)
+
+        seconds = time.monotonic() - begin
+        speed = (length - remaining) / seconds / 1e6 if seconds else 0
+        self.log_message("sent %s: %d bytes in %.2fs (%.1f MB/s)",
+                         self.path, length - remaining, seconds, speed)
+
+
+class ImageServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, directory):
+        super().__init__(address, ImageRequestHandler)
+        self.directory = directory
+
+
+def publish_image(src, directory, name):
+    """Move the image to the served directory, atomically replacing the old one."""
+    os.makedirs(directory, exist_ok=True)
+    dst = os.path.join(directory, name)
+    # parallel builds may publish at the same time
+    tmp = os.path.join(directory, ".{}.{}.{}.tmp".format(name, os.getpid(), threading.get_ident()))
+
+    # the move may copy between file systems, only the rename is atomic
+    shutil.move(src, tmp)
+    os.replace(tmp, dst)
+    return dst
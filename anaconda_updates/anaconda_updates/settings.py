@@ -6,6 +6,8 @@ import configparser
 class GlobalSettings(object):
     # Path to configuration file
     CONFIG_PATH = "~/.config/anaconda-updates/updates.cfg"
+    # Directory for data kept between runs (staging manifests...)
+    CACHE_PATH = "~/.cache/anaconda-updates"
 
     #######################
     # Global configuration
@@ -14,6 +16,14 @@ class GlobalSettings(object):
     PXE_server = ""       # Server with PXE which you are using to test anaconda
     server_path = ""      # Server path for saving updates image
     show_version_script_path = ""
+    targets = []          # List of (name, server, server path) to upload images to
+    ssh_control_persist = "10m"  # How long the shared ssh connection stays open, "no" to disable
+    shared_cache_path = ""  # Build cache shared with other users, empty for a private cache
+    shared_cache_size = 20  # Size limit of the shared build cache in GiB
+    worktree_pool_size = 4  # Maximal number of worktrees used by --commit builds
+    version_cache_ttl = 3600  # Seconds before a cached branch version is looked up again
+    repo_base_url = ""    # URL of the repositories read instead of the show version script
+    tag_versions = False  # Take versions from the release tags of the anaconda checkout
 
     #######################
     # Run specific configuration
@@ -32,6 +42,34 @@ class GlobalSettings(object):
     use_pykickstart = False
     use_simpleline = False
 
+    # create the image without the makeupdates script
+    native_image = False
+    # append changed files to the previous native image
+    delta = False
+    # upload the native image while it is created
+    pipeline = False
+    # only publish the image locally
+    no_upload = False
+    # don't reuse images from the build cache
+    no_cache = False
+    # upload even when the server has the same image
+    force_upload = False
+    # upload only changed blocks of the image
+    delta_upload = False
+    # number of compression threads used by the native builder
+    jobs = 1
+    # (codec, level) tuple of the image compression, None means branch default
+    compression = None
+
+    # look up versions of the branches even when they are cached
+    refresh_versions = False
+
+    # build this commit in a leased worktree instead of the anaconda checkout
+    commit = None
+
+    # how to stage blivet, pykickstart, simpleline and addons (copy or link)
+    stage_mode = "copy"
+
     @classmethod
     def read_configuration(cls):
         config = configparser.ConfigParser()
@@ -39,11 +77,26 @@ class GlobalSettings(object):
             config.read_file(f_cfg)
             global_settings = config["GlobalSettings"]
             cls.projects_path = global_settings["ProjectsPath"] # must be specified in config file
-            cls.show_version_script_path = global_settings["ShowVersionScriptPath"]
+            cls.show_version_script_path = global_settings.get("ShowVersionScriptPath", "")
             cls.anaconda_path = global_settings.get("anaconda_pathName", "anaconda")
 
             cls.PXE_server = global_settings["Server"]
             cls.server_path = global_settings["ServerPath"]
+            cls.ssh_control_persist = global_settings.get("SshControlPersist", "10m")
+            cls.shared_cache_path = os.path.expanduser(global_settings.get("SharedCachePath", ""))
+            cls.shared_cache_size = global_settings.getfloat("SharedCacheSize", 20)
+            cls.worktree_pool_size = global_settings.getint("WorktreePoolSize", 4)
+            cls.version_cache_ttl = global_settings.getint("VersionCacheTTL", 3600)
+            cls.repo_base_url = global_settings.get("RepoBaseURL", "")
+            cls.tag_versions = global_settings.getboolean("TagVersions", False)
+
+            # additional upload servers are in [Target <name>] sections
+            cls.targets = [(cls.PXE_server or "local", cls.PXE_server, cls.server_path)]
+            for section in config.sections():
+                if section.startswith("Target "):
+                    cls.targets.append((section[len("Target "):],
+                                        config[section]["Server"],
+                                        config[section]["ServerPath"]))
 
             # prevent cyclic imports
             from update_image import DirectoryNotFoundError
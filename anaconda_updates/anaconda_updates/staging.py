@@ -0,0 +1,178 @@
+import os
+import fcntl
+import shutil
+import hashlib
+
+from anaconda_updates.atomic import load_json, store_json
+
+# ioctl number of FICLONE from linux/fs.h
+FICLONE = 0x40049409
+
+STAGE_MODE_COPY = "copy"
+STAGE_MODE_LINK = "link"
+STAGE_MODES = (STAGE_MODE_COPY, STAGE_MODE_LINK)
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class StagingStats(object):
+    def __init__(self):
+        self.copied = 0
+        self.skipped = 0
+        self.deleted = 0
+        self.reflinked = 0
+        self.hardlinked = 0
+
+    def __str__(self):
+        msg = "{} copied, {} skipped, {} deleted".format(self.copied, self.skipped, self.deleted)
+        if self.reflinked or self.hardlinked:
+            msg += " ({} reflinked, {} hardlinked)".format(self.reflinked, self.hardlinked)
+        return msg
+
+
+class Manifest(object):
+    """Record of files staged from one source tree.
+
+    Every entry maps a path relative to the tree root to its size, mtime and
+    sha256 content hash, as seen when the file was staged last time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+
+    def load(self):
+        self.entries = load_json(self.path)
+
+    def save(self):
+        store_json(self.path, self.entries)
+
+
+class Stager(object):
+    """Keep a destination tree in sync with a source tree.
+
+    Only files which were added or changed since the last run are copied and
+    files which disappeared from the source are removed from the destination.
+
+    In the link mode files are reflinked where the file system supports it,
+    hard linked when it doesn't and copied only as the last resort (e.g. when
+    the destination is on a different file system).
+    """
+
+    def __init__(self, manifest_dir, mode=STAGE_MODE_COPY):
+        self._manifest_dir = manifest_dir
+        self._mode = mode
+        self._reflink_supported = True
+        self._hardlink_supported = True
+
+    def stage(self, name, source, dest):
+        manifest = Manifest(os.path.join(self._manifest_dir, name + ".json"))
+        manifest.load()
+
+        stats = StagingStats()
+        entries = {}
+
+        for rel_path, src_stat in self._walk(source):
+            src_path = os.path.join(source, rel_path)
+            dst_path = os.path.join(dest, rel_path)
+            old = manifest.entries.get(rel_path)
+
+            if old and old["size"] == src_stat.st_size and old["mtime_ns"] == src_stat.st_mtime_ns \
+                    and self._dest_matches(dst_path, old):
+                entries[rel_path] = old
+                stats.skipped += 1
+                continue
+
+            entry = {"size": src_stat.st_size,
+                     "mtime_ns": src_stat.st_mtime_ns,
+                     "hash": file_hash(src_path)}
+
+            if old and old["hash"] == entry["hash"] and self._dest_matches(dst_path, old):
+                # only touched, bring the timestamp in line with the source
+                os.utime(dst_path, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+                stats.skipped += 1
+            else:
+                self._copy(src_path, dst_path, stats)
+                stats.copied += 1
+
+            entries[rel_path] = entry
+
+        stats.deleted = self._remove_extra(dest, entries)
+
+        manifest.entries = entries
+        manifest.save()
+
+        return stats
+
+    @staticmethod
+    def _walk(root):
+        for dir_path, _, file_names in os.walk(root, followlinks=True):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                yield os.path.relpath(path, root), os.stat(path)
+
+    @staticmethod
+    def _dest_matches(dst_path, entry):
+        try:
+            dst_stat = os.stat(dst_path)
+        except FileNotFoundError:
+            return False
+
+        return dst_stat.st_size == entry["size"] and dst_stat.st_mtime_ns == entry["mtime_ns"]
+
+    def _copy(self, src_path, dst_path, stats):
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        if os.path.lexists(dst_path):
+            os.unlink(dst_path)
+
+        if self._mode == STAGE_MODE_LINK:
+            if self._reflink_supported:
+                if self._reflink(src_path, dst_path):
+                    stats.reflinked += 1
+                    return
+                self._reflink_supported = False
+
+            if self._hardlink_supported:
+                try:
+                    os.link(src_path, dst_path)
+                    stats.hardlinked += 1
+                    return
+                except OSError:
+                    self._hardlink_supported = False
+
+        shutil.copy2(src_path, dst_path)
+
+    @staticmethod
+    def _reflink(src_path, dst_path):
+        try:
+            with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            if os.path.lexists(dst_path):
+                os.unlink(dst_path)
+            return False
+
+        shutil.copystat(src_path, dst_path)
+        return True
+
+    @staticmethod
+    def _remove_extra(dest, entries):
+        deleted = 0
+
+        for dir_path, dir_names, file_names in os.walk(dest, topdown=False):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                if os.path.relpath(path, dest) not in entries:
+                    os.unlink(path)
+                    deleted += 1
+
+            if dir_path != dest and not os.listdir(dir_path):
+                os.rmdir(dir_path)
+
+        return deleted
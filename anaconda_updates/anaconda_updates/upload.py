@@ -0,0 +1,406 @@
+import os
+import re
+import hashlib
+import time
+import queue
+import shlex
+import shutil
+import threading
+import subprocess
+
+from anaconda_updates.atomic import load_json, store_json
+from anaconda_updates.staging import file_hash
+
+# number of chunks waiting for the upload before the producer is blocked
+QUEUE_SIZE = 16
+# checksum of the uploaded image is stored next to it with this suffix
+CHECKSUM_SUFFIX = ".sha256"
+
+
+class UploadError(Exception):
+    pass
+
+
+class Connection(object):
+    """Commands working with files on the upload server.
+
+    With the control directory all ssh, scp and rsync calls share one
+    multiplexed ssh connection (OpenSSH ControlMaster). The master stays
+    alive for control_persist after the last use, so following uploads and
+    even following runs skip the connection setup and authentication.
+
+    Empty server means a local directory, which is useful for testing.
+    """
+
+    def __init__(self, server, control_dir=None, control_persist="10m"):
+        self.server = server
+        self.control_dir = control_dir
+        self.control_persist = control_persist
+
+    def ssh_options(self):
+        if not self.control_dir:
+            return []
+
+        os.makedirs(self.control_dir, mode=0o700, exist_ok=True)
+        return ["-o", "ControlMaster=auto",
+                "-o", "ControlPath={}".format(os.path.join(self.control_dir, "%C")),
+                "-o", "ControlPersist={}".format(self.control_persist)]
+
+    def destination(self, path):
+        return "{}:{}".format(self.server, path) if self.server else path
+
+    def command(self, shell_command):
+        """Return command line running the shell command on the server."""
+        if self.server:
+            return ["ssh", *self.ssh_options(), self.server, shell_command]
+        return ["sh", "-c", shell_command]
+
+    def run(self, shell_command):
+        try:
+            return subprocess.check_output(self.command(shell_command),
+                                           stderr=subprocess.STDOUT).decode()
+        except subprocess.CalledProcessError as e:
+            raise UploadError("Command on {} failed: {}".format(self.server or "localhost",
+                                                                e.output.decode()))
+
+    def checksum(self, path):
+        """Return sha256 of the file on the server or None if it doesn't exist."""
+        try:
+            out = self.run("sha256sum {}".format(shlex.quote(path)))
+        except UploadError:
+            return None
+        return out.split()[0]
+
+    def store_checksum(self, path, digest):
+        # sha256sum -c compatible format
+        line = "{}  {}".format(digest, os.path.basename(path))
+        self.run("echo {} > {}".format(shlex.quote(line), shlex.quote(path + CHECKSUM_SUFFIX)))
+
+    def remove_checksum(self, path):
+        self.run("rm -f {}".format(shlex.quote(path + CHECKSUM_SUFFIX)))
+
+    def scp(self, src, path):
+        cmd = ["scp", *self.ssh_options(), src, self.destination(path)]
+        try:
+            return subprocess.check_output(cmd, stderr=subprocess.STDOUT).decode()
+        except subprocess.CalledProcessError as e:
+            raise UploadError("scp failed: {}".format(e.output.decode()))
+
+    def rsync(self, src, path):
+        """Upload the file by rsync, sending only blocks which differ from the remote copy.
+
+        Returns tuple of bytes sent literally and bytes matched in the remote copy.
+        """
+        if shutil.which("rsync") is None:
+            raise UploadError("rsync is not installed")
+
+        # delta transfer is disabled by default for local destinations
+        cmd = ["rsync", "--no-whole-file", "--stats"]
+        if self.server:
+            cmd.extend(["-e", " ".join(shlex.quote(arg) for arg in ["ssh", *self.ssh_options()])])
+        cmd.extend([src, self.destination(path)])
+
+        try:
+            out = subprocess.check_output(cmd, stderr=subprocess.STDOUT).decode()
+        except subprocess.CalledProcessError as e:
+            raise UploadError("rsync failed: {}".format(e.output.decode()))
+
+        return _stats_value(out, "Literal data"), _stats_value(out, "Matched data")
+
+
+def _stats_value(out, name):
+    match = re.search(r"^{}: ([\d,.]+)".format(name), out, re.MULTILINE)
+    return int(re.sub(r"[,.]", "", match.group(1))) if match else 0
+
+
+class StreamUpload(object):
+    """File object sending everything written to it to a file on the server.
+
+    Data are sent by a separate thread while they are produced. The queue
+    between the producer and the sending thread is bounded, so a slow link
+    slows the producer down instead of eating memory. Data go to a ".part"
+    file, it replaces the file only in close() after its checksum matches
+    the data written, so a crashed or aborted build never leaves a
+    truncated file on the server.
+    """
+
+    def __init__(self, connection, path, queue_size=QUEUE_SIZE):
+        self.server = connection.server or "localhost"
+        self.path = path
+        self.size = 0
+        self.seconds = 0.0
+        self._start = time.monotonic()
+        self._connection = connection
+        self._tmp_path = path + ".part"
+        self._hash = hashlib.sha256()
+
+        remote_cmd = "cat > {}".format(shlex.quote(self._tmp_path))
+        self._popen = subprocess.Popen(connection.command(remote_cmd),
+                                       stdin=subprocess.PIPE,
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT)
+        self._queue = queue.Queue(queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._send, daemon=True)
+        self._thread.start()
+
+    def _send(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                break
+            if self._error:
+                # keep consuming so the producer is never blocked
+                continue
+
+            try:
+                self._popen.stdin.write(chunk)
+            except OSError as e:
+                self._error = e
+
+    def write(self, data):
+        if self._error:
+            raise UploadError("Upload to {} failed: {}".format(self.server, self._error))
+
+        data = bytes(data)
+        self._hash.update(data)
+        self._queue.put(data)
+        self.size += len(data)
+        return len(data)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+        try:
+            self._popen.stdin.close()
+        except OSError as e:
+            self._error = self._error or e
+
+        out = self._popen.stdout.read().decode()
+        if self._popen.wait() != 0 or self._error:
+            self._remove_part()
+            raise UploadError("Upload to {} failed: {}".format(self.server, out or self._error))
+
+        digest = self._connection.checksum(self._tmp_path)
+        if digest != self._hash.hexdigest():
+            self._remove_part()
+            raise UploadError("Upload to {} failed: the uploaded file is incomplete".format(self.server))
+
+        # the checksum of the replaced file must not describe the new one
+        self._connection.run("rm -f {checksum} && mv {tmp} {path}".format(
+            checksum=shlex.quote(self.path + CHECKSUM_SUFFIX), tmp=shlex.quote(self._tmp_path),
+            path=shlex.quote(self.path)))
+        self.seconds = time.monotonic() - self._start
+
+    def _remove_part(self):
+        try:
+            self._connection.run("rm -f {}".format(shlex.quote(self._tmp_path)))
+        except (UploadError, OSError):
+            pass
+
+    def abort(self):
+        self._popen.kill()
+        self._queue.put(None)
+        self._thread.join()
+        self._popen.wait()
+        self._remove_part()
+
+
+class TeeWriter(object):
+    """Write data to the file and to the upload at the same time."""
+
+    def __init__(self, fileobj, upload):
+        self._fileobj = fileobj
+        self._upload = upload
+
+    def write(self, data):
+        self._upload.write(data)
+        return self._fileobj.write(data)
+
+    def tell(self):
+        return self._fileobj.tell()
+
+
+class UploadTarget(object):
+    def __init__(self, name, connection, path):
+        self.name = name
+        self.connection = connection
+        self.path = path
+
+
+class UploadResult(object):
+    def __init__(self, name, ok, size=0, seconds=0.0, message=""):
+        self.name = name
+        self.ok = ok
+        self.size = size
+        self.seconds = seconds
+        self.message = message.strip()
+
+    def __str__(self):
+        if not self.ok:
+            return "{}: FAILED {}".format(self.name, self.message)
+        if not self.size and self.message:
+            return "{}: {}".format(self.name, self.message)
+
+        speed = self.size / self.seconds / 1e6 if self.seconds else 0
+        msg = "{}: {} bytes in {:.2f}s ({:.1f} MB/s)".format(self.name, self.size, self.seconds, speed)
+        if self.message:
+            msg += ", " + self.message
+        return msg
+
+
+class FanOutUpload(object):
+    """Stream the same data to several targets at once.
+
+    Every target has its own upload thread, the data are produced only once.
+    """
+
+    def __init__(self, targets, img_name):
+        self._uploads = []
+        self._failed = []
+
+        for target in targets:
+            try:
+                upload = StreamUpload(target.connection, os.path.join(target.path, img_name))
+            except OSError as e:
+                self._failed.append(UploadResult(target.name, False, message=str(e)))
+            else:
+                self._uploads.append((target, upload))
+
+    def write(self, data):
+        for target, upload in list(self._uploads):
+            try:
+                upload.write(data)
+            except UploadError as e:
+                # a failed target must not stop the others
+                upload.abort()
+                self._uploads.remove((target, upload))
+                self._failed.append(UploadResult(target.name, False, message=str(e)))
+
+        if not self._uploads:
+            raise UploadError("Upload to all servers failed")
+
+        return len(data)
+
+    def close(self):
+        """Finish uploads and return list of results."""
+        results = list(self._failed)
+
+        for target, upload in self._uploads:
+            try:
+                upload.close()
+            except UploadError as e:
+                results.append(UploadResult(target.name, False, message=str(e)))
+            else:
+                results.append(UploadResult(target.name, True, upload.size, upload.seconds))
+
+        return results
+
+    def abort(self):
+        for _, upload in self._uploads:
+            upload.abort()
+
+
+class PushRecord(object):
+    """Local record of the image checksums successfully pushed to the servers.
+
+    Without the path the record is kept only in memory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def load(self):
+        if self.path is None:
+            return
+
+        self._entries = load_json(self.path)
+
+    def save(self):
+        if self.path is None:
+            return
+
+        with self._lock:
+            store_json(self.path, self._entries)
+
+    @staticmethod
+    def key(target, path):
+        return "{}:{}".format(target.connection.server, path)
+
+    def get(self, target, path):
+        with self._lock:
+            return self._entries.get(self.key(target, path))
+
+    def set(self, target, path, digest):
+        with self._lock:
+            self._entries[self.key(target, path)] = digest
+
+    def remove(self, target, path):
+        with self._lock:
+            self._entries.pop(self.key(target, path), None)
+
+
+def mark_uploaded(target, img_name, digest, record):
+    path = os.path.join(target.path, img_name)
+    target.connection.store_checksum(path, digest)
+    record.set(target, path, digest)
+
+
+def _upload_file(src, target, img_name, delta, digest, record, force):
+    path = os.path.join(target.path, img_name)
+    size = os.path.getsize(src)
+    message = ""
+    start = time.monotonic()
+
+    try:
+        # the local record may be outdated (e.g. the image was replaced on the
+        # server), only the image on the server tells whether it can be skipped
+        if not force and target.connection.checksum(path) == digest:
+            if record.get(target, path) == digest:
+                message = "same image pushed last time, skipped"
+            else:
+                mark_uploaded(target, img_name, digest, record)
+                message = "identical image on the server, skipped"
+            return UploadResult(target.name, True, 0, time.monotonic() - start, message)
+
+        # scp and rsync replace the image in place, nothing may describe the
+        # image on the server until the transfer finishes
+        record.remove(target, path)
+        target.connection.remove_checksum(path)
+
+        if delta:
+            try:
+                size, matched = target.connection.rsync(src, path)
+                message = "{} bytes matched".format(matched)
+            except UploadError as e:
+                message = "{}, whole image sent".format(e)
+                target.connection.scp(src, path)
+        else:
+            target.connection.scp(src, path)
+
+        mark_uploaded(target, img_name, digest, record)
+    except UploadError as e:
+        return UploadResult(target.name, False, seconds=time.monotonic() - start, message=str(e))
+
+    return UploadResult(target.name, True, size, time.monotonic() - start, message)
+
+
+def upload_file(src, img_name, targets, record, delta=False, force=False):
+    """Upload the file to all targets in parallel and return list of results.
+
+    Targets which already have the same image are skipped unless forced.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    digest = file_hash(src)
+
+    with ThreadPoolExecutor(max(1, len(targets))) as pool:
+        futures = [pool.submit(_upload_file, src, target, img_name, delta, digest, record, force)
+                   for target in targets]
+        results = [future.result() for future in futures]
+
+    record.save()
+    return results
@@ -0,0 +1,109 @@
+import os
+import time
+import fcntl
+import subprocess
+
+from contextlib import contextmanager
+
+DEFAULT_POOL_SIZE = 4
+# how often to look for a free worktree when all of them are leased
+WAIT_INTERVAL = 1
+POOL_LOCK = ".pool.lock"
+
+
+class WorktreeError(Exception):
+    pass
+
+
+def _git(path, *args):
+    try:
+        return subprocess.check_output(["git", "-C", path, *args],
+                                       stderr=subprocess.STDOUT).decode().strip()
+    except subprocess.CalledProcessError as e:
+        raise WorktreeError("git {} failed: {}".format(args[0], e.output.decode().strip()))
+
+
+class Worktree(object):
+    def __init__(self, name, path, commit):
+        self.name = name
+        self.path = path
+        self.commit = commit
+
+
+class WorktreePool(object):
+    """Pool of git worktrees of a repository used as isolated build checkouts.
+
+    Every build leases a free worktree with the requested commit checked
+    out and returns it when it is done. Worktrees share the objects of the
+    repository, so they are cheap to create and to switch. A worktree is
+    leased by holding a lock on its lock file, so leases work across
+    processes and a crashed build never keeps its worktree.
+
+    Staged updates folder and the image are kept in the worktree between
+    leases, everything else not tracked by git is removed.
+    """
+
+    def __init__(self, repo_dir, pool_dir, size=DEFAULT_POOL_SIZE):
+        self.repo_dir = repo_dir
+        self.pool_dir = pool_dir
+        self.size = size
+
+    def resolve(self, ref):
+        """Return id of the commit the ref points to."""
+        return _git(self.repo_dir, "rev-parse", "--verify", "--quiet", ref + "^{commit}")
+
+    def _try_lock(self, index):
+        fd = os.open(os.path.join(self.pool_dir, "{}.lock".format(index)), os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    def _acquire(self):
+        """Lock a free worktree slot, wait when all are leased. Return (index, lock fd)."""
+        os.makedirs(self.pool_dir, exist_ok=True)
+        waiting = False
+
+        while True:
+            for index in range(self.size):
+                fd = self._try_lock(index)
+                if fd is not None:
+                    return index, fd
+
+            if not waiting:
+                print("All {} worktrees are leased, waiting for a free one".format(self.size))
+                waiting = True
+            time.sleep(WAIT_INTERVAL)
+
+    def _checkout(self, path, commit):
+        if os.path.exists(os.path.join(path, ".git")):
+            _git(path, "checkout", "--quiet", "--force", "--detach", commit)
+            _git(path, "clean", "-fdq", "-e", "/updates", "-e", "/updates.img")
+            return
+
+        # adding worktrees changes the repository, don't do it concurrently
+        fd = os.open(os.path.join(self.pool_dir, POOL_LOCK), os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            # forget worktrees removed by hand
+            _git(self.repo_dir, "worktree", "prune")
+            _git(self.repo_dir, "worktree", "add", "--detach", path, commit)
+        finally:
+            os.close(fd)
+
+    @contextmanager
+    def lease(self, ref):
+        """Lease a worktree with the ref checked out."""
+        commit = self.resolve(ref)
+        index, fd = self._acquire()
+
+        try:
+            name = "{}-worktree-{}".format(os.path.basename(self.repo_dir), index)
+            path = os.path.join(self.pool_dir, name)
+            self._checkout(path, commit)
+            print("Building {} in worktree {}".format(ref, path))
+            yield Worktree(name, path, commit)
+        finally:
+            os.close(fd)
@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from anaconda_updates.cache import source_tree_id
+
+
+def git(repo, *args):
+    return subprocess.check_output(["git", "-C", repo, "-c", "user.name=Test", "-c", "user.email=test@example.com",
+                                    *args], stderr=subprocess.STDOUT).decode()
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(data)
+
+
+class SourceTreeIdTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.repo = os.path.join(self.tmp_dir, "repo")
+        write(os.path.join(self.repo, "src/a.py"), "a\n")
+        write(os.path.join(self.repo, "src/b.py"), "b\n")
+        git(self.repo, "init", "-q")
+        git(self.repo, "add", "--all")
+        git(self.repo, "commit", "-q", "-m", "init")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def objects(self):
+        return git(self.repo, "count-objects", "-v")
+
+    def tree_id(self):
+        return source_tree_id(self.repo, exclude=("updates",))
+
+    def test_clean(self):
+        self.assertEqual(self.tree_id(), "git:" + git(self.repo, "rev-parse", "HEAD^{tree}").strip())
+
+    def test_changes(self):
+        ids = {self.tree_id()}
+
+        write(os.path.join(self.repo, "src/a.py"), "changed\n")
+        ids.add(self.tree_id())
+        write(os.path.join(self.repo, "src/new/c.py"), "c\n")
+        ids.add(self.tree_id())
+        os.chmod(os.path.join(self.repo, "src/new/c.py"), 0o755)
+        ids.add(self.tree_id())
+        os.unlink(os.path.join(self.repo, "src/b.py"))
+        ids.add(self.tree_id())
+        git(self.repo, "add", "--all")
+        # staged or not, the files are the same
+        ids.add(self.tree_id())
+        self.assertEqual(len(ids), 5)
+
+        # excluded paths don't matter
+        current = self.tree_id()
+        write(os.path.join(self.repo, "updates/run/file"), "staged\n")
+        self.assertEqual(self.tree_id(), current)
+
+        # back to the committed state, the staged new files are removed too
+        git(self.repo, "reset", "-q", "--hard")
+        self.assertEqual(self.tree_id(), "git:" + git(self.repo, "rev-parse", "HEAD^{tree}").strip())
+
+    def test_nothing_written(self):
+        write(os.path.join(self.repo, "src/a.py"), "changed\n")
+        write(os.path.join(self.repo, "src/untracked.py"), "untracked\n")
+        objects = self.objects()
+        index = os.stat(os.path.join(self.repo, ".git", "index"))
+
+        self.tree_id()
+        self.assertEqual(self.objects(), objects)
+        self.assertEqual(os.stat(os.path.join(self.repo, ".git", "index")).st_mtime_ns, index.st_mtime_ns)
+
+    def test_not_repository(self):
+        directory = os.path.join(self.tmp_dir, "addon")
+        write(os.path.join(directory, "ks.py"), "addon\n")
+        first = source_tree_id(directory)
+        write(os.path.join(directory, "ks.py"), "changed\n")
+        self.assertNotEqual(source_tree_id(directory), first)
+
+
+if __name__ == "__main__":
+    unittest.main()
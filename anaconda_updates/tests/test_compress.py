@@ -0,0 +1,113 @@
+import io
+import gzip
+import lzma
+import random
+import unittest
+
+from anaconda_updates.compress import ParallelGzipWriter, ParallelXzWriter, open_compressor, CODECS
+
+BLOCK = 4096
+
+
+def sample_data(size, seed=0):
+    """Return compressible data with repetitions crossing the block boundaries."""
+    rnd = random.Random(seed)
+    words = [bytes(rnd.randrange(256) for _ in range(rnd.randrange(1, 40))) for _ in range(64)]
+    data = bytearray()
+    while len(data) < size:
+        data += rnd.choice(words)
+    return bytes(data[:size])
+
+
+# empty input, less than a block, exactly at the boundaries and over several blocks
+SIZES = (0, 1, BLOCK - 1, BLOCK, BLOCK + 1, 3 * BLOCK, 10 * BLOCK + 123)
+
+
+def compress(writer_class, data, jobs, write_size, **kwargs):
+    out = io.BytesIO()
+    with writer_class(out, jobs, block_size=BLOCK, **kwargs) as writer:
+        for offset in range(0, len(data), write_size):
+            writer.write(data[offset:offset + write_size])
+    return out.getvalue()
+
+
+class ParallelGzipWriterTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for jobs in (1, 2, 4):
+            for size in SIZES:
+                for write_size in (1000, BLOCK, 5 * BLOCK):
+                    with self.subTest(jobs=jobs, size=size, write_size=write_size):
+                        data = sample_data(size, seed=size)
+                        self.assertEqual(gzip.decompress(compress(ParallelGzipWriter, data, jobs, write_size)),
+                                         data)
+
+    def test_levels(self):
+        data = sample_data(5 * BLOCK)
+        for level in (1, 6, 9):
+            with self.subTest(level=level):
+                self.assertEqual(gzip.decompress(compress(ParallelGzipWriter, data, 3, BLOCK, level=level)),
+                                 data)
+
+    def test_uses_dictionary(self):
+        # the blocks are primed by the preceding block, so repeated blocks
+        # compress to almost nothing
+        block = sample_data(BLOCK)
+        compressed = compress(ParallelGzipWriter, block * 8, 4, BLOCK)
+        self.assertLess(len(compressed), 2 * len(compress(ParallelGzipWriter, block, 4, BLOCK)))
+
+    def test_header(self):
+        compressed = compress(ParallelGzipWriter, b"data", 2, BLOCK)
+        # no file name and no time, the output doesn't depend on where and when it is created
+        self.assertEqual(compressed[3], 0)
+        self.assertEqual(compressed[4:8], b"\0\0\0\0")
+
+    def test_close_twice(self):
+        out = io.BytesIO()
+        writer = ParallelGzipWriter(out, 2, block_size=BLOCK)
+        writer.write(b"data")
+        writer.close()
+        writer.close()
+        self.assertEqual(gzip.decompress(out.getvalue()), b"data")
+
+
+class ParallelXzWriterTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for jobs in (1, 2, 4):
+            for size in SIZES:
+                with self.subTest(jobs=jobs, size=size):
+                    data = sample_data(size, seed=size)
+                    self.assertEqual(lzma.decompress(compress(ParallelXzWriter, data, jobs, 1000, level=1)), data)
+
+
+class OpenCompressorTest(unittest.TestCase):
+
+    def test_codecs(self):
+        data = sample_data(3 * BLOCK)
+        for codec in CODECS:
+            for jobs in (1, 4):
+                with self.subTest(codec=codec, jobs=jobs):
+                    out = io.BytesIO()
+                    with open_compressor(out, jobs, codec) as compressor:
+                        compressor.write(data)
+                    out.seek(0)
+                    self.assertEqual(CODECS[codec].reader(out).read(), data)
+
+    def test_deterministic(self):
+        data = sample_data(3 * BLOCK)
+        for codec in CODECS:
+            for jobs in (1, 4):
+                with self.subTest(codec=codec, jobs=jobs):
+                    outputs = []
+                    for name in ("a.img", "b.img"):
+                        out = io.BytesIO()
+                        out.name = name
+                        with open_compressor(out, jobs, codec) as compressor:
+                            compressor.write(data)
+                        outputs.append(out.getvalue())
+                    self.assertEqual(outputs[0], outputs[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import io
+import os
+import stat
+import shutil
+import tempfile
+import unittest
+
+from anaconda_updates.cpio import CpioWriter, CpioReader, CpioEntry, CpioError, HEADER_SIZE, TRAILER_NAME
+
+
+def read_all(data):
+    """Return list of (name, mode, ino, data) of the entries in the archive."""
+    return [(entry.name, entry.mode, entry.ino, b"".join(chunks))
+            for entry, chunks in CpioReader(io.BytesIO(data))]
+
+
+class CpioTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip(self):
+        script = os.path.join(self.tmp_dir, "script.sh")
+        with open(script, "wb") as f:
+            f.write(b"#!/bin/sh\n")
+        os.chmod(script, 0o755)
+
+        out = io.BytesIO()
+        writer = CpioWriter(out)
+        writer.add_directory(".")
+        writer.add_directory("./usr", mode=0o700)
+        # every data size modulo 4, the names are padded differently too
+        for size in range(5):
+            writer.add_data("./usr/file{}".format("x" * size), b"d" * size)
+        writer.add_file("./usr/script.sh", script)
+        writer.add_file("./tmp", self.tmp_dir)
+        writer.write_trailer()
+
+        data = out.getvalue()
+        self.assertEqual(writer.size, len(data))
+        self.assertEqual(len(data) % 4, 0)
+
+        entries = read_all(data)
+        self.assertEqual([name for name, _, _, _ in entries],
+                         [".", "./usr"] + ["./usr/file" + "x" * size for size in range(5)] +
+                         ["./usr/script.sh", "./tmp"])
+        self.assertEqual(entries[1][1], stat.S_IFDIR | 0o700)
+        for size in range(5):
+            self.assertEqual(entries[2 + size][1], stat.S_IFREG | 0o644)
+            self.assertEqual(entries[2 + size][3], b"d" * size)
+        self.assertEqual(entries[7][1], stat.S_IFREG | 0o755)
+        self.assertEqual(entries[7][3], b"#!/bin/sh\n")
+        self.assertTrue(stat.S_ISDIR(entries[8][1]))
+
+        # new inode for every entry
+        self.assertEqual([ino for _, _, ino, _ in entries], list(range(1, 10)))
+
+    def test_trailer(self):
+        out = io.BytesIO()
+        writer = CpioWriter(out)
+        writer.add_data("./file", b"data")
+        writer.write_trailer()
+
+        data = out.getvalue()
+        trailer = data.rindex(b"070701")
+        # the name with its NUL is padded to 4 bytes together with the header
+        self.assertEqual(data[trailer + HEADER_SIZE:], TRAILER_NAME.encode() + b"\0" * 4)
+
+        # nothing after the trailer is read
+        self.assertEqual(len(read_all(data + b"garbage")), 1)
+
+    def test_concatenated(self):
+        # archives without trailers joined with one trailer read as one archive
+        out = io.BytesIO()
+        CpioWriter(out, first_ino=1).add_data("./a", b"a")
+        CpioWriter(out, first_ino=100).add_data("./b", b"bb")
+        CpioWriter(out).write_trailer()
+
+        self.assertEqual([(name, ino, data) for name, _, ino, data in read_all(out.getvalue())],
+                         [("./a", 1, b"a"), ("./b", 100, b"bb")])
+
+    def test_unconsumed_data(self):
+        out = io.BytesIO()
+        writer = CpioWriter(out)
+        writer.add_data("./a", b"a" * 10)
+        writer.add_data("./b", b"b")
+        writer.write_trailer()
+
+        names = [entry.name for entry, _ in CpioReader(io.BytesIO(out.getvalue()))]
+        self.assertEqual(names, ["./a", "./b"])
+
+    def test_size_changed(self):
+        writer = CpioWriter(io.BytesIO())
+        with self.assertRaises(CpioError):
+            writer.add_entry(CpioEntry("./a", stat.S_IFREG | 0o644, filesize=3), [b"ab"])
+
+    def test_truncated(self):
+        out = io.BytesIO()
+        writer = CpioWriter(out)
+        writer.add_data("./a", b"a" * 10)
+        writer.write_trailer()
+
+        with self.assertRaises(CpioError):
+            read_all(out.getvalue()[:HEADER_SIZE + 8])
+        with self.assertRaises(CpioError):
+            read_all(b"070707" + out.getvalue()[6:])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,183 @@
+import io
+import os
+import stat
+import zlib
+import shutil
+import tempfile
+import unittest
+import contextlib
+import subprocess
+
+from anaconda_updates.cache import FileCache
+from anaconda_updates.compress import CODECS
+from anaconda_updates.cpio import CpioReader
+from anaconda_updates.image import ImageBuilder
+
+TAG = "anaconda-30.25.6-1"
+
+
+def git(repo, *args):
+    subprocess.check_output(["git", "-C", repo, "-c", "user.name=Test", "-c", "user.email=test@example.com",
+                             *args], stderr=subprocess.STDOUT)
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(data)
+
+
+def gzip_members(data):
+    """Return the decompressed gzip members of the data."""
+    members = []
+    while data:
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        members.append(decompressor.decompress(data))
+        data = decompressor.unused_data
+    return members
+
+
+def archive_entries(data):
+    """Return mapping of the names in the cpio archive to (entry, data)."""
+    return {entry.name: (entry, b"".join(chunks)) for entry, chunks in CpioReader(io.BytesIO(data))}
+
+
+class ImageBuilderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.repo = os.path.join(self.tmp_dir, "anaconda")
+        self.output = os.path.join(self.tmp_dir, "updates.img")
+
+        write(os.path.join(self.repo, "pyanaconda/core.py"), "old\n")
+        write(os.path.join(self.repo, "data/anaconda.conf"), "conf\n")
+        write(os.path.join(self.repo, "tests/test.py"), "test\n")
+        git(self.repo, "init", "-q")
+        git(self.repo, "add", "--all")
+        git(self.repo, "commit", "-q", "-m", "release")
+        git(self.repo, "tag", TAG)
+
+        write(os.path.join(self.repo, "pyanaconda/core.py"), "new\n")
+        write(os.path.join(self.repo, "pyanaconda/modules/new.py"), "added\n")
+        write(os.path.join(self.repo, "tests/test.py"), "changed test\n")
+        git(self.repo, "add", "--all")
+        git(self.repo, "commit", "-q", "-m", "change")
+
+        self.updates = os.path.join(self.repo, "updates")
+        write(os.path.join(self.updates, "run/install/updates/blivet/__init__.py"), "blivet\n")
+        write(os.path.join(self.updates, "usr/share/anaconda/addons/org_test/ks.py"), "addon\n")
+        write(os.path.join(self.updates, "etc/custom"), "custom\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def build(self, tag=TAG, **kwargs):
+        builder = ImageBuilder(self.repo, tag=tag, **kwargs)
+        with contextlib.redirect_stdout(io.StringIO()):
+            builder.build(self.output)
+        with open(self.output, "rb") as f:
+            return f.read()
+
+    def test_content(self):
+        entries = archive_entries(b"".join(gzip_members(self.build())))
+
+        files = {name: data for name, (entry, data) in entries.items() if stat.S_ISREG(entry.mode)}
+        self.assertEqual(files, {
+            "./run/install/updates/pyanaconda/core.py": b"new\n",
+            "./run/install/updates/pyanaconda/modules/new.py": b"added\n",
+            "./run/install/updates/blivet/__init__.py": b"blivet\n",
+            "./usr/share/anaconda/addons/org_test/ks.py": b"addon\n",
+            "./etc/custom": b"custom\n",
+        })
+
+        # unchanged and not installed files are left out, the parent directories are created
+        self.assertNotIn("./usr/share/anaconda/anaconda.conf", entries)
+        for name in ("./run", "./run/install/updates/pyanaconda/modules", "./usr/share/anaconda/addons/org_test"):
+            self.assertIn(name, entries)
+
+        # inode numbers of files in different segments don't clash
+        inodes = [entry.ino for entry, _ in entries.values()]
+        self.assertEqual(len(set(inodes)), len(inodes))
+
+    def test_segments(self):
+        members = gzip_members(self.build())
+
+        # anaconda (with the other files), the addon, blivet and the trailer
+        # each compressed on its own
+        self.assertEqual(len(members), 4)
+        # only the last one ends the archive
+        for member in members[:-1]:
+            self.assertNotIn(b"TRAILER!!!", member)
+        self.assertEqual(len(archive_entries(members[-1])), 0)
+
+        # the concatenated segments are one archive
+        names = archive_entries(b"".join(members)).keys()
+        self.assertIn("./run/install/updates/pyanaconda/core.py", names)
+        self.assertIn("./etc/custom", names)
+        self.assertIn("./usr/share/anaconda/addons/org_test/ks.py", names)
+
+    def test_codecs(self):
+        for codec in CODECS:
+            with self.subTest(codec=codec):
+                data = self.build(codec=codec, jobs=2)
+                self.assertIn("./etc/custom", archive_entries(CODECS[codec].reader(io.BytesIO(data)).read()))
+
+    def test_cached_segments(self):
+        cache = FileCache(os.path.join(self.tmp_dir, "cache"))
+        first = self.build(cache=cache)
+        self.assertEqual(self.build(cache=cache), first)
+        self.assertEqual(cache.stats()["hits"], 3)
+
+        write(os.path.join(self.updates, "etc/custom"), "changed\n")
+        entries = archive_entries(b"".join(gzip_members(self.build(cache=cache))))
+        self.assertEqual(entries["./etc/custom"][1], b"changed\n")
+        self.assertEqual(entries["./run/install/updates/pyanaconda/core.py"][1], b"new\n")
+
+    def build_delta(self):
+        builder = ImageBuilder(self.repo, tag=TAG)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            builder.build_delta(self.output, os.path.join(self.tmp_dir, "chain"))
+        with open(self.output, "rb") as f:
+            return archive_entries(b"".join(gzip_members(f.read()))), out.getvalue()
+
+    def test_delta(self):
+        entries, out = self.build_delta()
+        self.assertIn("Creating full image: no previous image", out)
+
+        write(os.path.join(self.updates, "etc/custom"), "changed\n")
+        entries, out = self.build_delta()
+        self.assertIn("Appended 1 changed files", out)
+        self.assertEqual(entries["./etc/custom"][1], b"changed\n")
+        self.assertEqual(entries["./run/install/updates/pyanaconda/core.py"][1], b"new\n")
+
+        entries, out = self.build_delta()
+        self.assertIn("No files changed", out)
+        self.assertEqual(entries["./etc/custom"][1], b"changed\n")
+
+    def test_interrupted_delta(self):
+        self.build_delta()
+        chain_image = os.path.join(self.tmp_dir, "chain", "updates.img")
+
+        # a partial segment left behind by an interrupted append
+        write(os.path.join(self.updates, "etc/custom"), "changed\n")
+        with open(chain_image, "ab") as f:
+            f.write(b"\x1f\x8b\x08\x00partial")
+
+        entries, out = self.build_delta()
+        self.assertIn("Creating full image: the image doesn't match the chain state", out)
+        self.assertEqual(entries["./etc/custom"][1], b"changed\n")
+
+        write(os.path.join(self.updates, "etc/custom"), "again\n")
+        entries, out = self.build_delta()
+        self.assertIn("Appended 1 changed files", out)
+        self.assertEqual(entries["./etc/custom"][1], b"again\n")
+
+    def test_without_tag(self):
+        names = archive_entries(b"".join(gzip_members(self.build(tag=None)))).keys()
+        self.assertIn("./etc/custom", names)
+        self.assertNotIn("./run/install/updates/pyanaconda/core.py", names)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,193 @@
+import io
+import gzip
+import shutil
+import tempfile
+import threading
+import unittest
+import http.server
+
+from anaconda_updates.releases.repodata import RepodataResolver, RepodataError, rpm_vercmp, evr_cmp, newest_package
+
+REPOMD = """<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo">
+  <data type="primary">
+    <location href="repodata/{}-primary.xml.gz"/>
+  </data>
+</repomd>
+"""
+
+PACKAGE = """  <package type="rpm">
+    <name>{name}</name>
+    <arch>{arch}</arch>
+    <version epoch="{epoch}" ver="{ver}" rel="{rel}"/>
+  </package>
+"""
+
+
+def primary_xml(*packages):
+    """Return primary.xml with the packages, tuples (name, arch, epoch, ver, rel)."""
+    body = "".join(PACKAGE.format(name=name, arch=arch, epoch=epoch, ver=ver, rel=rel)
+                   for name, arch, epoch, ver, rel in packages)
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<metadata xmlns="http://linux.duke.edu/metadata/common" packages="{}">\n{}</metadata>\n'
+            .format(len(packages), body)).encode()
+
+
+class RpmVercmpTest(unittest.TestCase):
+
+    def test_equal(self):
+        self.assertEqual(rpm_vercmp("1.0", "1.0"), 0)
+        self.assertEqual(rpm_vercmp("1.05", "1.5"), 0)
+        self.assertEqual(rpm_vercmp("1.0", "1_0"), 0)
+
+    def test_numbers(self):
+        self.assertEqual(rpm_vercmp("1.10", "1.9"), 1)
+        self.assertEqual(rpm_vercmp("29.24.7", "30.25.6"), -1)
+        self.assertEqual(rpm_vercmp("1.0.1", "1.0"), 1)
+
+    def test_letters(self):
+        self.assertEqual(rpm_vercmp("1.0a", "1.0"), 1)
+        self.assertEqual(rpm_vercmp("1.0a", "1.0b"), -1)
+        # numbers are newer than letters
+        self.assertEqual(rpm_vercmp("1.1", "1.a"), 1)
+        self.assertEqual(rpm_vercmp("1a", "1.1"), -1)
+
+    def test_tilde(self):
+        self.assertEqual(rpm_vercmp("1.0~rc1", "1.0"), -1)
+        self.assertEqual(rpm_vercmp("1.0", "1.0~rc1"), 1)
+        self.assertEqual(rpm_vercmp("1.0~rc1", "1.0~rc2"), -1)
+        self.assertEqual(rpm_vercmp("1.0~~", "1.0~"), -1)
+
+    def test_caret(self):
+        self.assertEqual(rpm_vercmp("1.0^git1", "1.0"), 1)
+        self.assertEqual(rpm_vercmp("1.0^git1", "1.0.1"), -1)
+        self.assertEqual(rpm_vercmp("1.0^git1", "1.0~rc1"), 1)
+
+    def test_epoch(self):
+        self.assertEqual(evr_cmp(("1", "1.0", "1"), ("0", "2.0", "1")), 1)
+        self.assertEqual(evr_cmp((None, "1.0", "2"), ("0", "1.0", "10")), -1)
+
+
+class NewestPackageTest(unittest.TestCase):
+
+    def test_newest(self):
+        xml = primary_xml(("anaconda", "x86_64", "0", "30.25.6", "1.fc30"),
+                          ("anaconda", "src", "0", "99.0", "1"),
+                          ("anaconda", "x86_64", "0", "30.25.10", "1.fc30"),
+                          ("blivet", "noarch", "0", "100.0", "1"))
+        self.assertEqual(newest_package(io.BytesIO(xml), "anaconda"), ("0", "30.25.10", "1.fc30"))
+
+    def test_missing(self):
+        xml = primary_xml(("blivet", "noarch", "0", "3.1", "1"))
+        self.assertIsNone(newest_package(io.BytesIO(xml), "anaconda"))
+
+
+class _RepoHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        repo = self.server.repo
+        repo.requests.append((self.path, self.headers.get("If-None-Match"), self.client_address))
+
+        if not self.path.startswith("/fedora/repodata/"):
+            self.send_error(404)
+            return
+
+        if self.path.endswith("repomd.xml"):
+            if self.headers.get("If-None-Match") == repo.etag:
+                self.send_response(304)
+                self.send_header("ETag", repo.etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = REPOMD.format(repo.generation).encode()
+        elif self.path.endswith("{}-primary.xml.gz".format(repo.generation)):
+            body = gzip.compress(primary_xml(("anaconda", "x86_64", "0", repo.version, "1")))
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("ETag", repo.etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Repo(object):
+    """Repository served by the fixture server, publish() replaces its content."""
+
+    def __init__(self):
+        self.requests = []
+        self.generation = 0
+        self.version = ""
+        self.etag = ""
+
+    def publish(self, version):
+        self.generation += 1
+        self.version = version
+        self.etag = '"{}"'.format(self.generation)
+
+
+class RepodataResolverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.repo = _Repo()
+        self.repo.publish("30.25.6")
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _RepoHandler)
+        self.server.repo = self.repo
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = "http://127.0.0.1:{}/fedora/".format(self.server.server_address[1])
+        self.tmp_dir = tempfile.mkdtemp()
+        self.state_path = self.tmp_dir + "/repodata.json"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_conditional_get(self):
+        resolver = RepodataResolver(self.state_path)
+        self.assertEqual(resolver.resolve(self.url), ("0", "30.25.6", "1"))
+        self.assertEqual([path for path, _, _ in self.repo.requests],
+                         ["/fedora/repodata/repomd.xml", "/fedora/repodata/1-primary.xml.gz"])
+
+        # unchanged repository, only repomd.xml answered by 304
+        del self.repo.requests[:]
+        self.assertEqual(resolver.resolve(self.url), ("0", "30.25.6", "1"))
+        self.assertEqual(self.repo.requests[0][:2], ("/fedora/repodata/repomd.xml", '"1"'))
+        self.assertEqual(len(self.repo.requests), 1)
+
+        # the validators are kept on disk for the next process
+        del self.repo.requests[:]
+        self.assertEqual(RepodataResolver(self.state_path).resolve(self.url), ("0", "30.25.6", "1"))
+        self.assertEqual(len(self.repo.requests), 1)
+
+    def test_changed_repository(self):
+        resolver = RepodataResolver(self.state_path)
+        resolver.resolve(self.url)
+
+        self.repo.publish("30.25.7")
+        del self.repo.requests[:]
+        self.assertEqual(resolver.resolve(self.url), ("0", "30.25.7", "1"))
+        self.assertEqual([path for path, _, _ in self.repo.requests],
+                         ["/fedora/repodata/repomd.xml", "/fedora/repodata/2-primary.xml.gz"])
+
+    def test_connection_kept_open(self):
+        resolver = RepodataResolver(self.state_path)
+        resolver.resolve(self.url)
+        resolver.resolve(self.url)
+        self.assertEqual(len({address for _, _, address in self.repo.requests}), 1)
+
+    def test_missing_repository(self):
+        resolver = RepodataResolver(self.state_path)
+        with self.assertRaises(RepodataError):
+            resolver.resolve(self.url.replace("fedora", "nothing"))
+
+
+if __name__ == "__main__":
+    unittest.main()
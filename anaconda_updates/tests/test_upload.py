@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from anaconda_updates.staging import file_hash
+from anaconda_updates.upload import Connection, UploadTarget, UploadError, PushRecord, upload_file
+
+
+class FailingConnection(Connection):
+    """Local connection whose transfers fail after writing a part of the file."""
+
+    def scp(self, src, path):
+        with open(src, "rb") as f_in, open(path, "wb") as f_out:
+            f_out.write(f_in.read(3))
+        raise UploadError("scp failed: connection lost")
+
+
+class UploadFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.server_dir = os.path.join(self.tmp_dir, "server")
+        os.makedirs(self.server_dir)
+        self.target = UploadTarget("local", Connection(""), self.server_dir)
+        self.record = PushRecord(os.path.join(self.tmp_dir, "pushed.json"))
+        self.remote = os.path.join(self.server_dir, "updates.img")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def image(self, name, data):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def upload(self, src, target=None):
+        result, = upload_file(src, "updates.img", [target or self.target], self.record)
+        return result
+
+    def test_skip_same_image(self):
+        src = self.image("a.img", b"image a")
+        self.assertEqual(self.upload(src).size, len(b"image a"))
+        with open(self.remote + ".sha256") as f:
+            self.assertEqual(f.read(), "{}  updates.img\n".format(file_hash(src)))
+
+        result = self.upload(src)
+        self.assertTrue(result.ok)
+        self.assertEqual(result.message, "same image pushed last time, skipped")
+
+        # another client pushed the image, the record doesn't know it
+        result = upload_file(src, "updates.img", [self.target], PushRecord(None))[0]
+        self.assertEqual(result.message, "identical image on the server, skipped")
+
+    def test_image_replaced_on_server(self):
+        src = self.image("a.img", b"image a")
+        self.upload(src)
+
+        with open(self.remote, "wb") as f:
+            f.write(b"garbage")
+        os.unlink(self.remote + ".sha256")
+
+        result = self.upload(src)
+        self.assertTrue(result.ok)
+        self.assertEqual(result.size, len(b"image a"))
+        self.assertEqual(file_hash(self.remote), file_hash(src))
+
+    def test_failed_upload(self):
+        old = self.image("old.img", b"old image")
+        new = self.image("new.img", b"new image")
+        self.upload(old)
+
+        failing = UploadTarget("local", FailingConnection(""), self.server_dir)
+        self.assertFalse(self.upload(new, failing).ok)
+        # the truncated image is not described by the old checksum
+        self.assertFalse(os.path.exists(self.remote + ".sha256"))
+        self.assertIsNone(self.record.get(self.target, self.remote))
+
+        # e.g. bisecting, the previous image is pushed again
+        result = self.upload(old)
+        self.assertEqual(result.size, len(b"old image"))
+        self.assertEqual(file_hash(self.remote), file_hash(old))
+
+    def test_force(self):
+        src = self.image("a.img", b"image a")
+        self.upload(src)
+        result, = upload_file(src, "updates.img", [self.target], self.record, force=True)
+        self.assertEqual(result.size, len(b"image a"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,12 +3,27 @@
 import subprocess
 import os
 import sys
-import shutil
+import socket
+import tempfile
+import time
 
 from argparse import ArgumentParser
+from collections import Counter
 
-from anaconda_updates.releases import *
+from anaconda_updates.releases import branch_options, branch_names, find_branch, create_branch, all_branches
+from anaconda_updates.releases import repodata_resolver
 from anaconda_updates.settings import GlobalSettings
+from anaconda_updates.api import BuildSpec, PROJECTS, build
+from anaconda_updates.staging import STAGE_MODES
+from anaconda_updates.image import ImageBuilder, ImageBuildError
+from anaconda_updates.upload import Connection, UploadTarget, UploadError
+from anaconda_updates.cache import FileCache, DEFAULT_MAX_SIZE
+from anaconda_updates.compress import parse_codec, benchmark_codecs, CompressionError
+from anaconda_updates.releases.versions import VersionCache
+
+# Subcommands and optional features import their modules (HTTP server and
+# client, daemon, git tags, worktrees...) when they are used, so the common
+# build and --help don't pay for them.
 
 
 ## Exceptions ##
@@ -22,6 +37,12 @@ class ParseArgs(ArgumentParser):
         super().__init__()
 
         self._branch_group = self.add_mutually_exclusive_group(required=True)
+        self._branch_group.add_argument("--branches", dest="branches", metavar="BRANCH,...",
+                                        help=("build images of several branches in parallel, "
+                                              "branches are named by their options without "
+                                              "dashes (e.g. master,rhel8,f31)"))
+        self._branch_group.add_argument("--all", dest="all_branches", action="store_true",
+                                        help="build images of all branches in parallel")
 
         self.add_argument("-a", dest="alternative_dir", action="store_true",
                           help="use alternative anaconda-2 folder")
@@ -44,6 +65,44 @@ class ParseArgs(ArgumentParser):
                           help=("copy pykickstart to updates image."))
         self.add_argument("--simpleline", dest="use_simpleline", action="store_true",
                           help=("copy simpleline to updates image."))
+        self.add_argument("--native", dest="native_image", action="store_true",
+                          help=("create the image in-process instead of calling the "
+                                "makeupdates script"))
+        self.add_argument("--delta", dest="delta", action="store_true",
+                          help=("append only files changed since the last build to the previous "
+                                "image, implies --native"))
+        self.add_argument("--pipeline", dest="pipeline", action="store_true",
+                          help=("upload the image to the server while it is created, "
+                                "implies --native"))
+        self.add_argument("--no-upload", dest="no_upload", action="store_true",
+                          help=("don't upload the image, only publish it in the images directory "
+                                "(e.g. for the serve command)"))
+        self.add_argument("--no-cache", dest="no_cache", action="store_true",
+                          help="always build the image, don't use the build cache")
+        self.add_argument("--force-upload", dest="force_upload", action="store_true",
+                          help="upload the image even when the server has the same image already")
+        self.add_argument("--delta-upload", dest="delta_upload", action="store_true",
+                          help=("upload only blocks which differ from the image already on the "
+                                "server (requires rsync)"))
+        self.add_argument("-j", "--jobs", dest="jobs", type=int, default=os.cpu_count(),
+                          metavar="N",
+                          help=("number of threads compressing the image created by --native "
+                                "(default: number of CPUs)"))
+        self.add_argument("--compression", dest="compression", metavar="CODEC[:LEVEL]",
+                          help=("compression of the image created by --native: gzip, xz or "
+                                "none, optionally with a level (e.g. gzip:6). "
+                                "If not set, use branch specific."))
+        self.add_argument("--refresh-versions", dest="refresh_versions", action="store_true",
+                          help="look up the branch version even when it is cached")
+        self.add_argument("--commit", dest="commit", metavar="REF",
+                          help=("build the image of the commit in a worktree leased from a pool "
+                                "instead of the anaconda checkout; uncommitted changes are not "
+                                "included"))
+        self.add_argument("--stage-mode", dest="stage_mode", choices=STAGE_MODES,
+                          default="copy",
+                          help=("how to stage blivet, pykickstart, simpleline and addons; "
+                                "'link' uses reflinks or hard links and copies only "
+                                "when these are not possible"))
         self.add_argument("--add-addon", dest="add_addon", nargs=1, action="append",
                           default=[], metavar="path",
                           help=("add addon to the updates image structure. "
@@ -80,137 +139,595 @@ class ParseArgs(ArgumentParser):
             GlobalSettings.use_simpleline = True
         if self.nm.image_name:
             GlobalSettings.image_name = self.nm.image_name
+        if self.nm.native_image:
+            GlobalSettings.native_image = True
+        if self.nm.delta:
+            GlobalSettings.native_image = True
+            GlobalSettings.delta = True
+        if self.nm.no_upload:
+            GlobalSettings.no_upload = True
+        if self.nm.no_cache:
+            GlobalSettings.no_cache = True
+        if self.nm.force_upload:
+            GlobalSettings.force_upload = True
+        if self.nm.delta_upload:
+            GlobalSettings.delta_upload = True
+        if self.nm.pipeline:
+            GlobalSettings.native_image = True
+            GlobalSettings.pipeline = True
+        GlobalSettings.jobs = max(1, self.nm.jobs)
+        if self.nm.compression:
+            try:
+                GlobalSettings.compression = parse_codec(self.nm.compression)
+            except CompressionError as e:
+                self.error(str(e))
+        GlobalSettings.stage_mode = self.nm.stage_mode
+        GlobalSettings.commit = self.nm.commit
+        if self.nm.refresh_versions:
+            GlobalSettings.refresh_versions = True
+
+        if self.nm.branches or self.nm.all_branches:
+            # every branch has its own image name and target version
+            if self.nm.image_name or self.nm.target_version:
+                self.error("-n and -t can't be used with several branches")
+            if not self.nm.commit:
+                if self.nm.compile:
+                    self.error("-c can't be used with several branches without --commit")
+                # only the native builder can create the images apart from the checkout,
+                # with --commit every build has its own worktree
+                GlobalSettings.native_image = True
 
         return self.nm
 
 
-class CreateCommand(object):
-    def __init__(self, branch):
+class Executor(object):
+    """Create and upload the image of one branch.
+
+    The command line and the configuration are turned to a BuildSpec and
+    the image is built by anaconda_updates.api.build(), like the daemon
+    builds it, so both share the build cache.
+
+    By default the image is staged and created in the anaconda checkout.
+    With the work directory the staging folder and the state kept between
+    builds are in that directory, so several builds from one checkout don't
+    clash; this requires the native image builder. With the worktree the
+    image is created in that checkout instead of the anaconda checkout.
+
+    Runs using the same checkout (or work directory) take turns in staging
+    and building. Every run creates its image in its own temporary file, so
+    uploading and publishing it doesn't interfere with the next run.
+    """
+
+    def __init__(self, branch, work_dir=None, worktree=None):
         super().__init__()
         self._branch_obj = branch
+        if worktree:
+            self.anaconda_dir = worktree.path
+            checkout_name = worktree.name
+        else:
+            self.anaconda_dir = os.path.join(GlobalSettings.projects_path, GlobalSettings.anaconda_path)
+            checkout_name = GlobalSettings.anaconda_path
+        self.anaconda_dir = os.path.abspath(self.anaconda_dir)
 
-    def create_command(self, keep, compile):
-        cmd = ["./scripts/makeupdates"]
-
-        if keep:
-            cmd.append("-k")
+        if work_dir:
+            self._work_dir = work_dir
+            self._updates_dir = None
+        else:
+            # state of the builds in the updates folder of the checkout
+            self._work_dir = os.path.join(os.path.expanduser(GlobalSettings.CACHE_PATH), "checkouts",
+                                          checkout_name)
+            self._updates_dir = os.path.join(self.anaconda_dir, "updates")
+
+    @staticmethod
+    def upload_targets():
+        control_dir = None
+        if GlobalSettings.ssh_control_persist != "no":
+            control_dir = os.path.join(os.path.expanduser(GlobalSettings.CACHE_PATH), "ssh")
+
+        return [UploadTarget(name, Connection(server, control_dir, GlobalSettings.ssh_control_persist), path)
+                for name, server, path in GlobalSettings.targets]
+
+    def image_name(self):
+        return GlobalSettings.image_name if GlobalSettings.image_name is not None else self._branch_obj.img_name
+
+    def build_spec(self, keep, compile):
+        native = GlobalSettings.native_image
+        if native and compile:
+            print("Compilation is not supported by the native image builder - falling back to the "
+                  "makeupdates script")
+            native = False
+        if not native and self._updates_dir is None:
+            raise ValueError("The makeupdates script can't create the image in {}".format(self._work_dir))
 
         if GlobalSettings.push_only:
-            # create only from top so from top
-            cmd.append("-t")
-            cmd.append("HEAD")
+            # create only from top
+            tag, rpms, compile = "HEAD", [], False
         else:
-            version = self._branch_obj.version
-            input_args = self._branch_obj.input_args
+            tag, rpms = GlobalSettings.target, [os.path.abspath(rpm) for rpm in GlobalSettings.add_RPM]
 
-            if compile:
-                cmd.append("-c")
+        if tag is None and GlobalSettings.tag_versions:
+            from anaconda_updates.releases.tags import TagIndexError
+            try:
+                version = self._branch_obj.resolve_version(tags=tag_index(), rev=GlobalSettings.commit or "HEAD")
+            except TagIndexError as e:
+                raise ValueError("Can't find the version in the tags: {}".format(e))
+            tag = "anaconda-{}-1".format(version)
+
+        kwargs = cache_options()
+        if GlobalSettings.compression:
+            kwargs["codec"], kwargs["level"] = GlobalSettings.compression
+
+        return BuildSpec.from_branch(
+            self._branch_obj, self.anaconda_dir, os.path.abspath(os.path.join(images_dir(), self.image_name())),
+            projects_path=os.path.abspath(GlobalSettings.projects_path),
+            projects=[project for project in PROJECTS if getattr(GlobalSettings, "use_" + project)],
+            version_script=GlobalSettings.show_version_script_path, version_cache=version_cache(),
+            repo_base_url=GlobalSettings.repo_base_url,
+            resolver=repodata_resolver() if GlobalSettings.repo_base_url else None,
+            tag=tag, img_name=self.image_name(),
+            addons=[os.path.abspath(addon) for addon in GlobalSettings.add_addon], rpms=rpms,
+            native=native, compile=compile, keep=keep, jobs=GlobalSettings.jobs, stage_mode=GlobalSettings.stage_mode,
+            work_dir=self._work_dir, updates_dir=self._updates_dir,
+            delta=GlobalSettings.delta, pipeline=GlobalSettings.pipeline,
+            build_cache=not GlobalSettings.no_cache,
+            targets=[] if GlobalSettings.no_upload else self.upload_targets(),
+            push_record=os.path.join(os.path.expanduser(GlobalSettings.CACHE_PATH), "pushed.json"),
+            delta_upload=GlobalSettings.delta_upload, force_upload=GlobalSettings.force_upload,
+            **kwargs)
+
+    def run(self, keep, compile):
+        try:
+            spec = self.build_spec(keep, compile)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
 
-            if GlobalSettings.use_blivet:
-                input_args.extend(self._branch_obj.blivet_args)
-            if GlobalSettings.use_pykickstart:
-                input_args.extend(self._branch_obj.pykickstart_args)
-            if GlobalSettings.use_simpleline:
-                input_args.extend(self._branch_obj.simpleline_args)
+        try:
+            result = build(spec)
+        except (ImageBuildError, UploadError) as e:
+            print("Error creating updates image:", e)
+            sys.exit(1)
 
-            for rpm in GlobalSettings.add_RPM:
-                input_args.extend(["-a", rpm])
+        for upload in result.uploads:
+            print(upload)
+        print("Creating backup", result.image_path)
+
+        if not result.ok:
+            sys.exit(1)
 
-            if GlobalSettings.target:
-                commit_version = GlobalSettings.target
-            else:
-                commit_version = "anaconda-" + version + "-1"
 
-            cmd.append("-t")
-            cmd.append(commit_version)
-            cmd.extend(input_args)
+def images_dir():
+    return os.path.join(GlobalSettings.projects_path, "images")
+
+
+def cache_options():
+    """Return BuildSpec arguments of the build caches, the shared ones if they are configured."""
+    if GlobalSettings.shared_cache_path:
+        return {"cache_dir": os.path.abspath(GlobalSettings.shared_cache_path),
+                "cache_size": int(GlobalSettings.shared_cache_size * 1024 ** 3),
+                "shared_cache": True}
+    return {"cache_dir": os.path.abspath(os.path.expanduser(GlobalSettings.CACHE_PATH)),
+            "cache_size": DEFAULT_MAX_SIZE,
+            "shared_cache": False}
+
+
+def file_cache(name):
+    """Return the build cache of the given kind, the shared one if it is configured."""
+    options = cache_options()
+    return FileCache(os.path.join(options["cache_dir"], name), options["cache_size"], options["shared_cache"])
+
+
+def cache_stats(argv):
+    parser = ArgumentParser(prog="update_image.py cache-stats",
+                            description="show usage statistics of the build caches")
+    parser.parse_args(argv)
+
+    print("Cache directory:", GlobalSettings.shared_cache_path or os.path.expanduser(GlobalSettings.CACHE_PATH))
+    print("{:10} {:>8} {:>14} {:>8} {:>8} {:>9} {:>8} {:>10}".format(
+        "cache", "files", "size", "hits", "misses", "hit rate", "stores", "evictions"))
+    for name in ("builds", "segments"):
+        cache = file_cache(name)
+        stats = cache.stats()
+        count, size = cache.size()
+        hits, misses = stats.get("hits", 0), stats.get("misses", 0)
+        rate = "{:.0%}".format(hits / (hits + misses)) if hits + misses else "-"
+        print("{:10} {:>8} {:>14} {:>8} {:>8} {:>9} {:>8} {:>10}".format(
+            name, count, size, hits, misses, rate, stats.get("stores", 0), stats.get("evictions", 0)))
+
+    return 0
+
+
+def version_cache(refresh=False):
+    return VersionCache(os.path.join(os.path.expanduser(GlobalSettings.CACHE_PATH), "versions.json"),
+                        GlobalSettings.version_cache_ttl, refresh or GlobalSettings.refresh_versions)
+
+
+def list_versions(argv):
+    parser = ArgumentParser(prog="update_image.py list-versions",
+                            description=("look up the anaconda version of every branch and store them "
+                                         "in the version cache read by the builds"))
+    parser.add_argument("--cached", dest="cached", action="store_true",
+                        help="look up only versions missing in the cache or older than VersionCacheTTL")
+    nm = parser.parse_args(argv)
+
+    from concurrent.futures import ThreadPoolExecutor
+    from anaconda_updates.releases.repodata import RepodataError
+
+    branches = all_branches()
+    cache = version_cache(refresh=not nm.cached)
+
+    # branches sharing the repository (or script arguments) are looked up once
+    groups = {}
+    for branch in branches:
+        if not branch._version:
+            groups.setdefault(branch.version_source(), []).append(branch)
+
+    def resolve_group(group):
+        version = group[0].resolve_version(cache=cache)
+        # the builds of the other branches read the version under their own keys
+        for branch in group[1:]:
+            cache.get(branch.version_key(), lambda: version)
+        return version
+
+    versions = {}
+    if groups:
+        with ThreadPoolExecutor(max_workers=min(len(groups), 32)) as pool:
+            futures = {key: pool.submit(resolve_group, group) for key, group in groups.items()}
+            for key, future in futures.items():
+                try:
+                    version = future.result()
+                except (subprocess.SubprocessError, OSError, ValueError, RepodataError) as e:
+                    version = "error: {}".format(e)
+                for branch in groups[key]:
+                    versions[branch.name] = version
+
+    print("{:10} {:16} {}".format("branch", "version", "source"))
+    for branch in branches:
+        if branch._version:
+            version, source = branch._version, "branch definition"
+        else:
+            version = versions[branch.name]
+            source = branch.version_source()
+        print("{:10} {:16} {}".format(branch.name, version, source))
+
+    return 0 if not any(version.startswith("error:") for version in versions.values()) else 1
+
+
+def serve(argv):
+    parser = ArgumentParser(prog="update_image.py serve",
+                            description=("serve the latest image of every branch over HTTP, "
+                                         "use with inst.updates=http://<host>:<port>/<image name>"))
+    parser.add_argument("-b", "--bind", dest="bind", default="",
+                        help="address to listen on (default: all)")
+    parser.add_argument("-P", "--port", dest="port", type=int, default=8000,
+                        help="port to listen on (default: 8000)")
+    parser.add_argument("-d", "--directory", dest="directory", default=images_dir(),
+                        help="directory with the images (default: images in the projects directory)")
+    nm = parser.parse_args(argv)
+
+    from anaconda_updates.server import ImageServer
+
+    os.makedirs(nm.directory, exist_ok=True)
+    server = ImageServer((nm.bind, nm.port), nm.directory)
+    host = nm.bind or socket.gethostname()
+    print("Serving images from", nm.directory)
+    for name in sorted(os.listdir(nm.directory)):
+        if name.endswith(".img"):
+            print("  inst.updates=http://{}:{}/{}".format(host, nm.port, name))
 
-        return cmd
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    return 0
+
+
+def bench_codecs(argv):
+    parser = ArgumentParser(prog="update_image.py bench-codecs",
+                            description=("compress the staged updates folder with every codec "
+                                         "and compare the results"))
+    parser.add_argument("-a", dest="alternative_dir", action="store_true",
+                        help="use alternative anaconda-2 folder")
+    parser.add_argument("--codecs", dest="codecs", default="gzip:1,gzip:6,gzip:9,xz:1,xz:6,none",
+                        metavar="CODEC[:LEVEL],...",
+                        help="codecs to compare")
+    parser.add_argument("--link-speed", dest="link_speed", type=float, default=100,
+                        metavar="Mbit/s",
+                        help="speed of the link used to estimate the transfer time")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=os.cpu_count(),
+                        metavar="N", help="number of compression threads")
+    nm = parser.parse_args(argv)
+
+    if nm.alternative_dir:
+        GlobalSettings.anaconda_path = "anaconda-2"
+
+    specs = nm.codecs.split(",")
+    try:
+        for spec in specs:
+            parse_codec(spec)
+    except CompressionError as e:
+        parser.error(str(e))
+
+    builder = ImageBuilder(os.path.join(GlobalSettings.projects_path, GlobalSettings.anaconda_path),
+                           tag=None)
+    files = builder.collect()
+    if not files:
+        print("Nothing is staged in", builder.updates_dir, file=sys.stderr)
+        return 1
+
+    with tempfile.TemporaryDirectory(prefix="anaconda-updates-bench-") as tmp_dir:
+        archive_path = os.path.join(tmp_dir, "updates.cpio")
+        with open(archive_path, "wb") as f:
+            size = builder.write_archive(f, files)
+
+        print("Staged tree: {} files, {} bytes of cpio".format(len(files), size))
+        print("{:10} {:>12} {:>10} {:>12} {:>10} {:>10}".format(
+            "codec", "size", "compress", "decompress", "transfer", "total"))
+        for spec, comp_size, comp_time, decomp_time, transfer_time in \
+                benchmark_codecs(archive_path, specs, max(1, nm.jobs), nm.link_speed):
+            print("{:10} {:>12} {:>9.3f}s {:>11.3f}s {:>9.3f}s {:>9.3f}s".format(
+                spec, comp_size, comp_time, decomp_time, transfer_time,
+                comp_time + decomp_time + transfer_time))
+
+    return 0
+
+
+def worktree_pool():
+    from anaconda_updates.worktree import WorktreePool
+    return WorktreePool(os.path.join(GlobalSettings.projects_path, GlobalSettings.anaconda_path),
+                        os.path.join(os.path.expanduser(GlobalSettings.CACHE_PATH), "worktrees",
+                                     GlobalSettings.anaconda_path),
+                        GlobalSettings.worktree_pool_size)
+
+
+def tag_index():
+    """Return index of the release tags of the anaconda checkout."""
+    from anaconda_updates.releases.tags import TagIndex
+    return TagIndex(os.path.join(GlobalSettings.projects_path, GlobalSettings.anaconda_path),
+                    os.path.join(os.path.expanduser(GlobalSettings.CACHE_PATH), "tags",
+                                 GlobalSettings.anaconda_path + ".json"))
+
+
+def build_image(branch, keep, compile, work_dir=None):
+    """Create and upload the image of the branch.
+
+    With --commit the image is created in a worktree leased from the pool.
+    """
+    if not GlobalSettings.commit:
+        Executor(branch, work_dir).run(keep, compile)
+        return
+
+    from anaconda_updates.worktree import WorktreeError
+    try:
+        with worktree_pool().lease(GlobalSettings.commit) as worktree:
+            Executor(branch, worktree=worktree).run(keep, compile)
+    except WorktreeError as e:
+        print("Can't prepare worktree:", e, file=sys.stderr)
+        sys.exit(1)
 
 
-class Executor(object):
-    def __init__(self, branch):
-        super().__init__()
-        self._branch_obj = branch
+def build_branch(name, keep, compile, img_name=None):
+    """Create and upload the image of one branch of a batch, return the summary.
+
+    Runs in a worker process, output of the build goes to a log in the work
+    directory of the branch. The image is named img_name when set.
+    """
+    # the branch may change the global settings, this is fine only in the
+    # process building that branch
+    branch = create_branch(name)
+    branch.apply_settings()
+    if img_name is not None:
+        GlobalSettings.image_name = img_name
+    work_dir = os.path.join(os.path.expanduser(GlobalSettings.CACHE_PATH), "batch",
+                            GlobalSettings.anaconda_path, branch.name)
+    os.makedirs(work_dir, exist_ok=True)
+    log_path = os.path.join(work_dir, "build.log")
+    start = time.monotonic()
+    status = 0
+
+    with open(log_path, "w") as f_log:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # also the output of git, ssh and other commands
+        os.dup2(f_log.fileno(), 1)
+        os.dup2(f_log.fileno(), 2)
 
-    def prepare(self):
         try:
-            os.makedirs(os.path.join(GlobalSettings.projects_path, GlobalSettings.anaconda_path, "updates/run/install/updates"))
-        except os.error as e:
-            print("Updates directory exists already")
-
-        addon_img_path = os.path.join(
-            GlobalSettings.projects_path,
-            GlobalSettings.anaconda_path,
-            "updates/usr/share/anaconda/addons/"
-        )
+            build_image(branch, keep, compile, work_dir)
+        except SystemExit as e:
+            status = e.code
+        except Exception:
+            import traceback
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+
+    image_path = os.path.join(images_dir(), GlobalSettings.image_name or branch.img_name)
+    return {"branch": branch.name,
+            "ok": not status,
+            "image": image_path if not status else "",
+            "size": os.path.getsize(image_path) if not status else 0,
+            "seconds": time.monotonic() - start,
+            "log": log_path}
+
+
+def batch_image_names(names):
+    """Return mapping of the branches to the names of their images in a batch.
+
+    Builds of one image would overwrite each other on the servers, so the
+    branches sharing an image name (e.g. Fedora releases and master) are
+    named <branch>_updates.img instead.
+    """
+    img_names = {name: create_branch(name).img_name for name in names}
+    counts = Counter(img_names.values())
+    return {name: img_name if counts[img_name] == 1 else "{}_updates.img".format(name)
+            for name, img_name in img_names.items()}
+
+
+def build_branches(names, keep, compile):
+    """Build images of the branches in parallel, print summary and return exit code."""
+    img_names = batch_image_names(names)
+    workers = min(len(names), os.cpu_count())
+    # share the CPUs among the builds
+    GlobalSettings.jobs = max(1, GlobalSettings.jobs // workers)
+
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    print("Building", ", ".join(names))
+    # workers inherit the configuration and arguments in GlobalSettings
+    context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        futures = [pool.submit(build_branch, name, keep, compile, img_names[name]) for name in names]
+        results = [future.result() for future in futures]
+
+    print("{:12} {:6} {:>10} {:>8}  {}".format("branch", "status", "size", "time", "image / log"))
+    for result in results:
+        print("{:12} {:6} {:>10} {:>7.1f}s  {}".format(
+            result["branch"], "ok" if result["ok"] else "FAILED", result["size"],
+            result["seconds"], result["image"] if result["ok"] else result["log"]))
+
+    return 0 if all(result["ok"] for result in results) else 1
+
+
+def daemon_socket_path():
+    return os.path.join(os.path.expanduser(GlobalSettings.CACHE_PATH),
+                        "daemon-{}.sock".format(GlobalSettings.anaconda_path))
+
+
+def daemon(argv):
+    parser = ArgumentParser(prog="update_image.py daemon",
+                            description=("build images on requests of 'update_image.py submit' "
+                                         "keeping caches, versions and ssh connections warm"))
+    parser.add_argument("-a", dest="alternative_dir", action="store_true",
+                        help="use alternative anaconda-2 folder")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=os.cpu_count(),
+                        metavar="N", help="number of compression threads of every build")
+    nm = parser.parse_args(argv)
+
+    from anaconda_updates.daemon import BuildDaemon, DaemonError
+
+    if nm.alternative_dir:
+        GlobalSettings.anaconda_path = "anaconda-2"
+
+    branches = {}
+    for branch in all_branches():
+        for name in branch_names(branch.name):
+            branches[name] = branch
+
+    cache_path = os.path.expanduser(GlobalSettings.CACHE_PATH)
+    config = {"anaconda_dir": os.path.abspath(os.path.join(GlobalSettings.projects_path,
+                                                           GlobalSettings.anaconda_path)),
+              "projects_path": os.path.abspath(GlobalSettings.projects_path),
+              "cache_dir": cache_path,
+              "cache": cache_options(),
+              "images_dir": os.path.abspath(images_dir()),
+              "version_script": GlobalSettings.show_version_script_path,
+              "version_cache": version_cache(),
+              "tags": tag_index() if GlobalSettings.tag_versions else None,
+              "repo_base_url": GlobalSettings.repo_base_url,
+              "resolver": repodata_resolver() if GlobalSettings.repo_base_url else None,
+              "jobs": max(1, nm.jobs)}
+
+    build_daemon = BuildDaemon(daemon_socket_path(), branches, Executor.upload_targets(), config)
+    print("Waiting for requests on", build_daemon.socket_path)
+    try:
+        build_daemon.serve()
+    except DaemonError as e:
+        print(e, file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+def submit(argv):
+    parser = ArgumentParser(prog="update_image.py submit",
+                            description="let the running daemon build or push the image of the branch")
+    parser.add_argument("branch", nargs="?",
+                        help="branch named by its option without dashes (e.g. master, rhel8, f31)")
+    parser.add_argument("-a", dest="alternative_dir", action="store_true",
+                        help="use the daemon of the alternative anaconda-2 folder")
+    parser.add_argument("--push", dest="push", action="store_true",
+                        help="only upload the last image of the branch")
+    parser.add_argument("--stop", dest="stop", action="store_true",
+                        help="stop the daemon")
+    parser.add_argument("-t", "--target", dest="target", metavar="version",
+                        help="target version in git format, if not set use branch specific")
+    parser.add_argument("-n", "--name", dest="image_name", help="set the name of the image")
+    for project in ("blivet", "pykickstart", "simpleline"):
+        parser.add_argument("--" + project, dest="projects", action="append_const", const=project,
+                            default=[], help="copy {} to updates image".format(project))
+    parser.add_argument("--add-addon", dest="addons", action="append", default=[], metavar="path",
+                        help="add addon to the updates image")
+    parser.add_argument("--add-rpm", dest="rpms", nargs="+", default=[], metavar="paths",
+                        help="add RPM packages to updates image")
+    parser.add_argument("--compression", dest="compression", metavar="CODEC[:LEVEL]",
+                        help="compression of the image, if not set use branch specific")
+    parser.add_argument("--no-upload", dest="no_upload", action="store_true",
+                        help="only publish the image in the images directory")
+    parser.add_argument("--force-upload", dest="force_upload", action="store_true",
+                        help="upload the image even when the server has the same image already")
+    nm = parser.parse_args(argv)
+
+    if nm.alternative_dir:
+        GlobalSettings.anaconda_path = "anaconda-2"
+
+    if nm.stop:
+        message = {"command": "stop"}
+    elif not nm.branch:
+        parser.error("the branch is required")
+    elif nm.push:
+        message = {"command": "push", "branch": nm.branch, "image_name": nm.image_name,
+                   "force_upload": nm.force_upload}
+    else:
+        message = {"command": "build", "branch": nm.branch, "target": nm.target,
+                   "image_name": nm.image_name, "projects": nm.projects,
+                   "addons": [os.path.abspath(os.path.expanduser(addon)) for addon in nm.addons],
+                   "rpms": [os.path.abspath(rpm) for rpm in nm.rpms],
+                   "compression": nm.compression, "no_upload": nm.no_upload,
+                   "force_upload": nm.force_upload}
+
+    from anaconda_updates.daemon import request as daemon_request, DaemonError
+    try:
+        result = daemon_request(daemon_socket_path(), message, sys.stdout)
+    except OSError as e:
+        print("Can't connect to the daemon ({}), start it by 'update_image.py daemon'".format(e),
+              file=sys.stderr)
+        return 1
+    except DaemonError as e:
+        # e.g. the daemon crashed or was stopped during the request
+        print(e, file=sys.stderr)
+        return 1
+    except ValueError as e:
+        print("Invalid response of the daemon: {}".format(e), file=sys.stderr)
+        return 1
 
-        if GlobalSettings.add_addon:
-            try:
-                os.makedirs(addon_img_path)
-            except os.error as e:
-                print("Can't create addon directory!")
+    if not result["ok"]:
+        print("Failed:", result.get("message", ""), file=sys.stderr)
+    for upload in result.get("uploads", []):
+        print(upload)
+    if "image" in result:
+        print("Image {}{}".format(result["image"], " (from the build cache)" if result.get("cached") else ""))
 
-        for addon in GlobalSettings.add_addon:
-            try:
-                print("Copy addon", addon)
-                shutil.rmtree(addon_img_path)
-                dst=os.path.join(addon_img_path, os.path.split(addon)[1])
-                shutil.copytree(addon, dst)
-            except FileExistsError as e:
-                print("Can't copy addon")
-
-        if GlobalSettings.use_blivet:
-            print("Copy blivet...")
-            source = os.path.join(GlobalSettings.projects_path, "blivet/blivet")
-            dest = os.path.join(GlobalSettings.projects_path, GlobalSettings.anaconda_path, "updates/run/install/updates/blivet")
-            try:
-                shutil.copytree(source, dest)
-            except FileExistsError as e:
-                print("Skipping blivet copy:", str(e))
-
-        if GlobalSettings.use_pykickstart:
-            print("Copy pykickstart...")
-            source = os.path.join(GlobalSettings.projects_path, "pykickstart/pykickstart")
-            dest = os.path.join(GlobalSettings.projects_path, GlobalSettings.anaconda_path, "updates/run/install/updates/pykickstart")
-            try:
-                shutil.copytree(source, dest)
-            except FileExistsError as e:
-                print("Skipping pykickstart copy:", str(e))
-
-        if GlobalSettings.use_simpleline:
-            print("Copy simpleline...")
-            source = os.path.join(GlobalSettings.projects_path, "simpleline/simpleline")
-            dest = os.path.join(GlobalSettings.projects_path, GlobalSettings.anaconda_path, "updates/run/install/updates/simpleline")
-            try:
-                shutil.copytree(source, dest)
-            except FileExistsError as e:
-                print("Skipping simpleline copy:", str(e))
-
-    def create_updates_img(self, command):
-        os.chdir(os.path.join(GlobalSettings.projects_path, GlobalSettings.anaconda_path))
-        print("Calling command:", command)
-
-        popen = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        out, err = popen.communicate()
-        if popen.returncode != 0:
-            print("Error calling makeupdates script")
-            print(out.decode())
-            sys.exit(1)
-        else:
-            print(out.decode())
+    return 0 if result["ok"] else 1
 
-    def upload_image(self):
-        img_name = GlobalSettings.image_name if GlobalSettings.image_name is not None else self._branch_obj.img_name
-        src = os.path.join(GlobalSettings.projects_path, GlobalSettings.anaconda_path, "updates.img")
-        dst_local = os.path.join("../images/", img_name)
-        dst_srv = os.path.join(GlobalSettings.PXE_server + ":" + GlobalSettings.server_path, img_name)
 
-        print("Uploading image to server")
-        out = subprocess.check_output(["scp", src, dst_srv], stderr=subprocess.STDOUT).decode()
-        print(out)
-        shutil.move(src, dst_local)
-        print("Creating backup", dst_local)
+# subcommands which don't work with a branch
+COMMANDS = {
+    "bench-codecs": bench_codecs,
+    "cache-stats": cache_stats,
+    "daemon": daemon,
+    "list-versions": list_versions,
+    "serve": serve,
+    "submit": submit,
+}
 
 
 if __name__ == "__main__":
@@ -228,28 +745,29 @@ if __name__ == "__main__":
         print(e, file=sys.stderr)
         sys.exit(3)
 
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        sys.exit(COMMANDS[sys.argv[1]](sys.argv[2:]))
+
     # parse input arguments
     parser = ParseArgs()
-    branch = None
-    instances = []
 
-    # setup arg parse
-    for cls in GeneralBranch.__subclasses__():
-        inst = cls()
-        inst.add_argument(parser)
-        instances.append(inst)
+    # setup arg parse, only the selected branch is created
+    for name, options, help_text in branch_options():
+        parser.add_branch_param(*options, const_val=name, help=help_text)
 
     nm = parser.parse_args()
 
-    for branch_inst in instances:
-        if branch_inst.type == nm.branch:
-            branch = branch_inst
-            break
-
-    create_cmd = CreateCommand(branch)
-    cmd = create_cmd.create_command(keep=nm.keep, compile=nm.compile)
-
-    executor = Executor(branch)
-    executor.prepare()
-    executor.create_updates_img(cmd)
-    executor.upload_image()
+    if nm.branches or nm.all_branches:
+        try:
+            if nm.all_branches:
+                names = [name for name, _options, _help in branch_options()]
+            else:
+                # the same branch may be given by several of its names
+                names = list(dict.fromkeys(find_branch(name) for name in nm.branches.split(",")))
+        except ValueError as e:
+            parser.error(str(e))
+        sys.exit(build_branches(names, nm.keep, nm.compile))
+
+    branch = create_branch(nm.branch)
+    branch.apply_settings()
+    build_image(branch, nm.keep, nm.compile)